@@ -0,0 +1,25 @@
+"""
+Benchmarks, run from the repository root with::
+
+    python -m benchmarks.<name> --help
+"""
+import os
+
+from recommendr.db import MemoryBackend
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'data')
+
+
+def load_ratings(filename='ratings_dev.dat'):
+    """
+    Load a MovieLens ratings file from the data directory into a
+    MemoryBackend.
+    """
+    db = MemoryBackend()
+    with open(os.path.join(DATA_DIR, filename), 'r') as ratings:
+        for rating in ratings:
+            user_id, movie_id, score, timestamp = rating.split("::")
+            db.add_rating(user_id, movie_id, score)
+    return db
@@ -0,0 +1,129 @@
+"""
+Measure the recall@k of a ReviewerLSHIndex, two ways.
+
+First, against exact search by the similarity it approximates: the cosine
+of reviewers' mean-centered rating vectors, with unrated movies as zero.
+Candidates are ranked by that same cosine, so recall only reflects which
+neighbors the index finds. Picking the same fraction of reviewers at random
+would give a recall about equal to that fraction, which is printed
+alongside for comparison.
+
+Second, end to end: ``closest_reviewers(r, lsh_index=index)`` against
+``closest_reviewers(r)``, both by Pearson correlation. Pearson only counts
+the movies two reviewers have in common, so it differs from the centered
+cosine, and this recall is lower. Many Pearson scores tie at 1.0, so recall
+is also given counting any neighbor that scores at least the exact kth
+score as found.
+
+Reviewers who gave every movie the same rating have no centered direction,
+and aren't sampled.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+import recommendr
+from recommendr.lsh import ReviewerLSHIndex, center_ratings
+
+from . import load_ratings
+
+
+def recall_at_k(exact, approximate):
+    """
+    Fraction of the exact top k reviewers found by the approximate search.
+    """
+    if not exact:
+        return 1.0
+    found = set(reviewer for _, reviewer in approximate)
+    return len([reviewer for _, reviewer in exact if reviewer in found]) / float(len(exact))
+
+
+def tied_recall_at_k(exact, approximate):
+    """
+    Fraction of the approximate top k scoring at least the exact kth score,
+    so that ties at the kth place don't count as misses.
+    """
+    if not exact:
+        return 1.0
+    kth = exact[-1][0]
+    return len([reviewer for score, reviewer in approximate
+                if score >= kth]) / float(len(exact))
+
+
+def main(k, sample_size, settings):
+    backend = load_ratings()
+    matrix, reviewer_ids, movie_ids = backend.get_ratings_matrix()
+    centered = center_ratings(matrix)
+    norms = np.sqrt(np.asarray(centered.multiply(centered).sum(axis=1)).ravel())
+    rows = dict((int(reviewer_id), row)
+                for row, reviewer_id in enumerate(reviewer_ids))
+    sample = random.Random(0).sample(
+        [int(reviewer_ids[row]) for row in np.flatnonzero(norms > 0)], sample_size)
+
+    start = time.time()
+    scores, exact = {}, {}
+    for reviewer_id in sample:
+        row = rows[reviewer_id]
+        cosines = centered.dot(centered[row].T).toarray().ravel()
+        cosines /= np.where(norms > 0, norms, 1) * norms[row]
+        cosines[row] = -np.inf
+        scores[reviewer_id] = dict(zip(reviewer_ids.tolist(), cosines))
+        top = np.argsort(-cosines, kind='mergesort')[:k]
+        exact[reviewer_id] = [(cosines[i], int(reviewer_ids[i])) for i in top]
+    exact_time = (time.time() - start) / sample_size
+
+    recommendr.db = backend
+    start = time.time()
+    exact_pearson = dict(
+        (reviewer_id, recommendr.closest_reviewers(reviewer_id, n=k))
+        for reviewer_id in sample)
+    exact_pearson_time = (time.time() - start) / sample_size
+
+    print("{0} reviewers, k={1}, exact: {2:.1f} ms/query by cosine, "
+          "{3:.1f} ms/query by closest_reviewers".format(
+              len(reviewer_ids), k, exact_time * 1000,
+              exact_pearson_time * 1000))
+    print("\t\t\tcosine\t\tclosest_reviewers")
+    print("tables\tbits\tcandidates\trecall@k\trecall@k\ttied\tms/query")
+    for num_tables, num_bits in settings:
+        # every index stores its buckets under the same backend keys, so
+        # each one is measured before the next is built
+        index = ReviewerLSHIndex(backend, num_tables=num_tables,
+                                 num_bits=num_bits)
+        index.build()
+        recalls, candidates = [], []
+        for reviewer_id in sample:
+            found = index.candidates(reviewer_id) - set([reviewer_id])
+            approximate = sorted(
+                ((scores[reviewer_id][other], other) for other in found),
+                reverse=True)[:k]
+            candidates.append(len(found))
+            recalls.append(tied_recall_at_k(exact[reviewer_id], approximate))
+        pearson_recalls, tied = [], []
+        start = time.time()
+        for reviewer_id in sample:
+            approximate = recommendr.closest_reviewers(reviewer_id, n=k,
+                                                       lsh_index=index)
+            pearson_recalls.append(recall_at_k(exact_pearson[reviewer_id],
+                                               approximate))
+            tied.append(tied_recall_at_k(exact_pearson[reviewer_id],
+                                         approximate))
+        elapsed = (time.time() - start) / sample_size
+        print("{0}\t{1}\t{2:.1%}\t\t{3:.3f}\t\t{4:.3f}\t\t{5:.3f}\t{6:.1f}".format(
+            num_tables, num_bits,
+            sum(candidates) / float(len(candidates) * len(reviewer_ids)),
+            sum(recalls) / len(recalls),
+            sum(pearson_recalls) / len(pearson_recalls),
+            sum(tied) / len(tied), elapsed * 1000))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', type=int, default=10,
+                        help="Number of neighbors. Defaults to 10")
+    parser.add_argument('-s', '--sample', type=int, default=100,
+                        help="Number of reviewers queried. Defaults to 100")
+    args = parser.parse_args()
+    main(args.k, args.sample, [(8, 6), (16, 8), (32, 8), (64, 8), (32, 10),
+                               (64, 10)])
@@ -0,0 +1,63 @@
+"""
+Measure the recall@k and latency of factor model recommendations retrieved
+through a FactorIndex, against scoring every movie, for a range of index
+settings.
+"""
+import argparse
+import random
+import time
+
+from recommendr.factorization import FactorModel
+from recommendr.mips import FactorIndex
+
+from . import load_ratings
+from .lsh_recall import recall_at_k
+
+
+def main(k, sample_size, num_factors, ratings_file, settings):
+    backend = load_ratings(ratings_file)
+    model = FactorModel.train(backend, num_factors=num_factors)
+    reviewers = sorted(backend.get_reviewers())
+    sample = random.Random(0).sample(reviewers, sample_size)
+    unrated = dict((reviewer_id, backend.get_unrated_movies_for(reviewer_id))
+                   for reviewer_id in sample)
+
+    start = time.time()
+    exact = dict((reviewer_id, model.recommend(reviewer_id, num=k,
+                                               candidates=unrated[reviewer_id]))
+                 for reviewer_id in sample)
+    exact_time = (time.time() - start) / sample_size
+
+    print("{0} movies, {1} factors, k={2}, exact: {3:.2f} ms/query".format(
+        len(model.movie_ids), num_factors, k, exact_time * 1000))
+    print("clusters\tprobes\trecall@k\tms/query")
+    for num_clusters, probes in settings:
+        index = FactorIndex(model, num_clusters=num_clusters, probes=probes)
+        index.build()
+        recalls = []
+        start = time.time()
+        for reviewer_id in sample:
+            approximate = index.recommend(reviewer_id, num=k,
+                                          candidates=unrated[reviewer_id])
+            recalls.append(recall_at_k(exact[reviewer_id], approximate))
+        elapsed = (time.time() - start) / sample_size
+        print("{0}\t\t{1}\t{2:.3f}\t\t{3:.2f}".format(
+            num_clusters, probes, sum(recalls) / len(recalls), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', type=int, default=10,
+                        help="Number of recommendations. Defaults to 10")
+    parser.add_argument('-s', '--sample', type=int, default=50,
+                        help="Number of reviewers queried. Defaults to 50")
+    parser.add_argument('-f', '--factors', type=int, default=20,
+                        help="Number of latent factors. Defaults to 20")
+    parser.add_argument('-r', '--ratings', default='ratings_dev.dat',
+                        help="Ratings file in the data directory. The index "
+                             "only pays off with many movies, so try the "
+                             "full MovieLens ratings.dat. Defaults to "
+                             "ratings_dev.dat")
+    args = parser.parse_args()
+    main(args.k, args.sample, args.factors, args.ratings,
+         [(16, 1), (16, 2), (16, 4), (32, 2), (32, 4), (32, 8), (64, 8)])
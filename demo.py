@@ -11,7 +11,9 @@ for usage.
 import argparse
 import random
 
-from recommendr import db, get_user_based_recommendations
+from recommendr import (db, get_user_based_recommendations,
+                        get_model_based_recommendations)
+from recommendr.factorization import FactorModel
 
 
 def rate_movie(user_id, movie_id):
@@ -51,10 +53,13 @@ def rate_movies(user_id):
             rated += 1
 
 
-def get_recommendations(user_id):
+def get_recommendations(user_id, model=None):
     print("OK, let me think...")
 
-    recommendations = get_user_based_recommendations(user_id, num=10)
+    if model is not None:
+        recommendations = get_model_based_recommendations(user_id, model, num=10)
+    else:
+        recommendations = get_user_based_recommendations(user_id, num=10)
 
     print("Based on your ratings, I recommend the following movies:")
     print("\n")
@@ -71,6 +76,8 @@ if __name__ == '__main__':
                         help="Recommendations only.")
     parser.add_argument('-u', '--user', type=int, default=10000,
                         help="User id. Defaults to 10000")
+    parser.add_argument("--model",
+                        help="Recommend from a factor model saved at this path.")
     args = parser.parse_args()
 
     if args.movie:
@@ -78,4 +85,5 @@ if __name__ == '__main__':
     else:
         if not args.recommendations:
             rate_movies(args.user)
-        get_recommendations(args.user)
+        model = FactorModel.load(args.model) if args.model else None
+        get_recommendations(args.user, model)
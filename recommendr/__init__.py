@@ -4,15 +4,34 @@ __version__ = '0.0.1'
 Functions for performing similarity calculations.
 """
 
+import functools
+import heapq
+import inspect
 import sys
+import threading
+import time
+import warnings
+from bisect import bisect_right
+from collections import Counter
+import multiprocessing
+from multiprocessing import cpu_count
 
+import numpy as np
+from scipy import sparse
 from eventlet import GreenPool
 
-from .similarity import sim_pearson, sim_distance
-from .db import RedisBackend
-from .config import REDIS_HOST, REDIS_PORT, REDIS_DB
+from .similarity import (sim_pearson, sim_distance, pairwise_rating_sums,
+                         array_function, sums_function)
+from .db import RedisBackend, MemoryBackend
+from .sketch import MinHashSketches
+from .config import (REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PAIR_STATS,
+                     REDIS_TRACK_DIRTY, REDIS_INVALIDATE_CACHE)
 
-db = RedisBackend(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+db = RedisBackend(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+                  pair_stats=REDIS_PAIR_STATS, track_dirty=REDIS_TRACK_DIRTY,
+                  invalidate_cache=REDIS_INVALIDATE_CACHE)
+# an optional cache.LRUCache or cache.RedisCache of recommendation results
+result_cache = None
 
 
 def get_reviewer_similarity(reviewer_1, reviewer_2, sim_function=sim_pearson):
@@ -20,39 +39,177 @@ def get_reviewer_similarity(reviewer_1, reviewer_2, sim_function=sim_pearson):
     Returns the similarity coefficient for two reviewers, based on common
     movies they have rated.
     """
-    return sim_function(db.get_common_ratings_for_reviewers(reviewer_1,
-                                                            reviewer_2))
+    return db.get_similarity_for_reviewers(reviewer_1, reviewer_2,
+                                           sim_function=sim_function)
 
 
 def get_movie_similarity(movie_1, movie_2, sim_function=sim_pearson):
     """
     Returns the similarity coefficient for two movies.
     """
-    return sim_function(db.get_common_ratings_for_movies(movie_1, movie_2))
+    return db.get_similarity_for_movies(movie_1, movie_2,
+                                        sim_function=sim_function)
 
 
-def closest_reviewers(reviewer_id, n=5, similarity=sim_pearson):
+def top_scores(scores, ids, target_id, n):
+    """
+    Returns the n highest (score, id) tuples from aligned arrays of scores
+    and ids, leaving out target_id. Ties are broken as in a reversed sort.
+    """
+    others = np.flatnonzero(ids != target_id)
+    order = others[np.lexsort((ids[others], scores[others]))[::-1][:n]]
+    return [(float(scores[i]), int(ids[i])) for i in order]
+
+
+def closest_in_matrix(matrix, ids, target_id, n=5, similarity=sim_pearson,
+                      min_common=0):
+    """
+    Returns the top n rows of a sparse rating matrix most similar to the row
+    for target_id, as (score, id) tuples. All rows are scored at once using
+    the array-based counterpart of the similarity function, raising
+    ValueError if it has none. Rows with fewer than ``min_common`` ratings
+    in common with the target are left out.
+    """
+    ids = np.asarray(ids)
+    rows = np.flatnonzero(ids == target_id)
+    if len(rows):
+        ratings = matrix[rows[0]].toarray().ravel()
+    else:
+        ratings = np.zeros(matrix.shape[1])
+    scores = array_function(similarity)(ratings, matrix)
+    if min_common:
+        rated = sparse.csr_matrix(matrix, dtype=np.float64)
+        rated.data = (rated.data != 0).astype(np.float64)
+        common = rated.dot((ratings != 0).astype(np.float64))
+        keep = np.flatnonzero(common >= min_common)
+        scores, ids = scores[keep], ids[keep]
+    return top_scores(scores, ids, target_id, n)
+
+
+def all_closest_in_matrix(matrix, ids, n=5, similarity=sim_pearson,
+                          block_size=256):
+    """
+    Yields (id, top n scores) for every column of a sparse rating matrix,
+    comparing each column with all the others. Columns are processed in
+    blocks of block_size, each scored with a few sparse matrix products.
+    """
+    ids = np.asarray(ids)
+    matrix = matrix.tocsc()
+    from_sums = sums_function(similarity)
+    for start in range(0, matrix.shape[1], block_size):
+        columns = np.arange(start, min(start + block_size, matrix.shape[1]))
+        scores = from_sums(*pairwise_rating_sums(matrix, columns))
+        for offset, column in enumerate(columns):
+            yield int(ids[column]), top_scores(scores[:, offset], ids,
+                                               ids[column], n)
+
+
+def co_reviewer_counts(reviewer_id):
+    """
+    Returns a Counter of the number of movies each other reviewer has rated
+    in common with the given reviewer, gathered in one pass over the
+    reviewers of each movie the reviewer has rated.
+    """
+    movies = db.get_ratings_for_reviewer(reviewer_id)
+    counts = Counter()
+    for reviewers in db.get_reviewers_for_movies(movies).values():
+        counts.update(reviewers)
+    del counts[reviewer_id]
+    return counts
+
+
+def _batch_matrix(matrix):
+    """
+    Returns the (matrix, reviewer_ids, movie_ids) rating matrix for a batch
+    mode call: the one given, or else the backend's own, if it holds it in
+    memory. Loading it from Redis reads every rating, far more than a single
+    query needs, so that is left to the caller, to do once.
+    """
+    if matrix is not None:
+        return matrix
+    if not db.in_memory:
+        raise ValueError("batch mode needs the rating matrix: pass "
+                         "matrix=db.get_ratings_matrix(), loaded once, "
+                         "or use a MemoryBackend")
+    return db.get_ratings_matrix()
+
+
+def closest_reviewers(reviewer_id, n=5, similarity=sim_pearson, batch=False,
+                      candidates=None, lsh_index=None, min_common=1,
+                      matrix=None):
     """
     Returns the top n most similar reviewers to the given reviewer.
+
+    Only reviewers who have rated at least ``min_common`` of the same movies
+    are compared, found through the reviewers of each movie this reviewer
+    rated. With a ``min_common`` of 0, every other reviewer is compared.
+    Alternatively, the reviewer ids to compare may be given as
+    ``candidates``, which may be any iterable, including a generator. Only
+    the best n scores are held at any time. Given a ReviewerLSHIndex as
+    ``lsh_index``, the candidates are the reviewers sharing a bucket with
+    this one, and with at least ``min_common`` movies in common. The index
+    finds them by the cosine of centered ratings, which resembles
+    ``sim_pearson`` but no other similarity function, so using it with any
+    other gives a warning. Even for Pearson, the result is approximate; see
+    ``benchmarks/lsh_recall.py`` for how closely it matches.
+
+    In batch mode, the reviewer is scored against every other reviewer in a
+    single vectorized operation over the rating matrix, keeping those with
+    at least ``min_common`` movies in common. The matrix is the
+    ``get_ratings_matrix`` result passed as ``matrix``, so that it can be
+    loaded once for many calls, or, for a MemoryBackend, the backend's own;
+    otherwise ValueError is raised. Only similarity functions with a
+    vectorized counterpart are supported there; others raise ValueError.
     """
-    others = db.get_reviewers()
-    scores = [(get_reviewer_similarity(reviewer_id, other, sim_function=similarity), other)
-              for other in others if other != reviewer_id]
-    scores.sort()
-    scores.reverse()
-    return scores[:n]
+    if batch:
+        ratings, reviewer_ids, _ = _batch_matrix(matrix)
+        return closest_in_matrix(ratings, reviewer_ids, reviewer_id, n=n,
+                                 similarity=similarity, min_common=min_common)
+    if candidates is None and lsh_index is not None:
+        if similarity is not sim_pearson:
+            warnings.warn("ReviewerLSHIndex approximates centered cosine "
+                          "similarity, which {0} does not resemble".format(
+                              getattr(similarity, '__name__', similarity)))
+        candidates = lsh_index.candidates(reviewer_id)
+        if min_common:
+            counts = co_reviewer_counts(reviewer_id)
+            candidates = [other for other in candidates
+                          if counts[other] >= min_common]
+    if candidates is None and min_common:
+        candidates = [other for other, count in
+                      co_reviewer_counts(reviewer_id).items()
+                      if count >= min_common]
+    if candidates is None:
+        candidates = db.get_reviewers()
+    scores = ((get_reviewer_similarity(reviewer_id, other, sim_function=similarity), other)
+              for other in candidates if other != reviewer_id)
+    return heapq.nlargest(n, scores)
 
 
-def closest_movies(movie_id, n=5, similarity=sim_pearson):
+def closest_movies(movie_id, n=5, similarity=sim_pearson, batch=False,
+                   candidates=None, matrix=None):
     """
     Returns the top n closest movies to the given movie.
+
+    Movies are compared with every other movie, or with the movie ids in
+    ``candidates``, which may be any iterable, including a generator. Only
+    the best n scores are held at any time.
+
+    In batch mode, the movie is scored against every other movie in a single
+    vectorized operation over the rating matrix, which is found as for
+    ``closest_reviewers``. Only similarity functions with a vectorized
+    counterpart are supported there; others raise ValueError.
     """
-    movies = db.get_movies()
-    scores = [(get_movie_similarity(movie_id, other, sim_function=similarity), other)
-              for other in movies if other != movie_id]
-    scores.sort()
-    scores.reverse()
-    return scores[:n]
+    if batch:
+        ratings, _, movie_ids = _batch_matrix(matrix)
+        ratings, movie_ids = _listed_movies(ratings, movie_ids)
+        return closest_in_matrix(ratings.T.tocsr(), movie_ids, movie_id, n=n,
+                                 similarity=similarity)
+    if candidates is None:
+        candidates = db.get_movies()
+    scores = ((get_movie_similarity(movie_id, other, sim_function=similarity), other)
+              for other in candidates if other != movie_id)
+    return heapq.nlargest(n, scores)
 
 
 def do_movie_similarity_calculation(movie_id, n=10, similarity=sim_pearson):
@@ -64,53 +221,477 @@ def do_movie_similarity_calculation(movie_id, n=10, similarity=sim_pearson):
     db.save_similarity_scores(movie_id, scores)
 
 
-def calculate_similar_movies(n=10, similarity=sim_pearson):
+def _init_worker(backend):
+    """
+    Point a worker process at its own backend.
+    """
+    global db
+    db = backend.clone()
+
+
+def _push_score(heaps, movie_id, score, other, n):
+    """
+    Offer (score, other) to the bounded min-heap holding movie_id's top n.
+    """
+    heap = heaps.setdefault(movie_id, [])
+    if len(heap) < n:
+        heapq.heappush(heap, (score, other))
+    elif (score, other) > heap[0]:
+        heapq.heapreplace(heap, (score, other))
+
+
+def _calculate_movie_pairs(movie_ids, movies, n, similarity, heaps=None,
+                           sketches=None, min_overlap=None):
+    """
+    Score each of movie_ids against every later movie in the sorted list of
+    movies. Each unordered pair is computed once, and the score is offered to
+    both movies' top n heaps. Returns the heaps, keyed by movie id.
+
+    Given MinHash ``sketches``, pairs estimated to share fewer than
+    ``min_overlap`` reviewers are skipped without being scored.
+    """
+    if heaps is None:
+        heaps = {}
+    for movie_id in movie_ids:
+        others = movies[bisect_right(movies, movie_id):]
+        if sketches is not None:
+            others = sketches.candidates(movie_id, others, min_overlap)
+        for other in others:
+            score = get_movie_similarity(movie_id, other, sim_function=similarity)
+            _push_score(heaps, movie_id, score, other, n)
+            _push_score(heaps, other, score, movie_id, n)
+    return heaps
+
+
+def calculate_similar_movies(n=10, similarity=sim_pearson, executor='greenlet',
+                             processes=None, snapshot=False, min_overlap=None,
+                             num_hashes=64, start_method=None):
     """
     Calculate and save similarity scores for all movies in the database. this
-    will take a long time. Algorithm is parallelized using a greenlet pool.
+    will take a long time. Similarity is symmetric, so each pair of movies is
+    scored once, and the score is counted towards both movies' top n.
+
+    If ``min_overlap`` is given, each movie's reviewers are first sketched
+    with ``num_hashes`` MinHash functions, and pairs estimated to share fewer
+    than ``min_overlap`` reviewers are never scored.
+
+    With the default 'greenlet' executor, the algorithm is parallelized using
+    a greenlet pool, which only overlaps network waits. With the 'process'
+    executor, movies are partitioned across a pool of ``processes`` worker
+    processes (one per CPU by default), each with its own Redis connection,
+    opened from the connection settings of ``db``. If ``snapshot`` is set,
+    the ratings are instead loaded into memory once. Workers share that
+    read-only snapshot when forked; with any other ``start_method``
+    ('spawn', 'forkserver'), each is sent a pickled copy. ``start_method``
+    defaults to the platform's.
     """
-    pool = GreenPool(size=30)
-    movies = db.get_movies()
+    # every movie is about to be refreshed
+    db.take_dirty_movies()
+    movies = sorted(db.get_movies())
     movie_count = len(movies)
     sys.stdout.write("Processing {0} movies\n".format(movie_count))
+    heaps = {}
+    sketches = None
+    if min_overlap is not None:
+        sketches = MinHashSketches.from_backend(db, movies,
+                                                num_hashes=num_hashes)
+    if executor == 'greenlet':
+        pool = GreenPool(size=30)
+        for movie in movies:
+            pool.spawn_n(_calculate_movie_pairs, [movie], movies, n, similarity,
+                         heaps, sketches, min_overlap)
+        pool.waitall()
+    elif executor == 'process':
+        processes = processes or cpu_count()
+        backend = MemoryBackend.from_backend(db) if snapshot else db
+        # interleave movies, as earlier movies have more pairs to score
+        num_chunks = min(processes * 4, movie_count) or 1
+        chunks = [movies[start::num_chunks] for start in range(num_chunks)]
+        context = (multiprocessing.get_context(start_method) if start_method
+                   else multiprocessing)
+        pool = context.Pool(processes, initializer=_init_worker,
+                            initargs=(backend,))
+        try:
+            results = [pool.apply_async(_calculate_movie_pairs,
+                                        (chunk, movies, n, similarity, None,
+                                         sketches, min_overlap))
+                       for chunk in chunks]
+            for result in results:
+                for movie_id, heap in result.get().items():
+                    for score, other in heap:
+                        _push_score(heaps, movie_id, score, other, n)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        raise ValueError("Unknown executor: {0}".format(executor))
     for movie in movies:
-        pool.spawn_n(do_movie_similarity_calculation, movie, n=n, similarity=sim_distance)
-    pool.waitall()
+        db.save_similarity_scores(movie, sorted(heaps.get(movie, []),
+                                                reverse=True))
 
 
-def get_user_based_recommendations(reviewer_id, num=20, similarity=sim_distance):
+def _listed_movies(matrix, movie_ids):
     """
-    Get movie recommendations for the given user. Returns the top num movies,
-    using the given similarity function. This function does not make use
-    of any pre-calculated movie similarity scores.
+    Returns a (reviewers x movies) rating matrix and its movie ids, keeping
+    only the columns of movies in ``db.get_movies()``. Movies rated but
+    never added are left out, as the pairwise functions leave them out.
+    """
+    movies = db.get_movies()
+    keep = np.array([int(movie_id) in movies for movie_id in movie_ids],
+                    dtype=bool)
+    columns = np.flatnonzero(keep)
+    return sparse.csc_matrix(matrix)[:, columns], np.asarray(movie_ids)[columns]
+
+
+def calculate_similar_movies_in_matrix(n=10, similarity=sim_pearson,
+                                       block_size=256):
+    """
+    Calculate and save similarity scores for all movies in the database. The
+    ratings are loaded into a sparse matrix once, and every pair of movies is
+    scored by blocked sparse matrix products rather than pairwise calls.
+    Only the top n scores per movie are saved.
+    """
+    # every movie is about to be refreshed
+    db.take_dirty_movies()
+    matrix, _, movie_ids = db.get_ratings_matrix()
+    matrix, movie_ids = _listed_movies(matrix, movie_ids)
+    sys.stdout.write("Processing {0} movies\n".format(len(movie_ids)))
+    for movie_id, scores in all_closest_in_matrix(matrix, movie_ids, n=n,
+                                                  similarity=similarity,
+                                                  block_size=block_size):
+        db.save_similarity_scores(movie_id, scores)
+
+
+def refresh_similar_movies(n=10, similarity=sim_pearson):
+    """
+    Recalculate and save the similarity scores of the movies rated since the
+    last refresh, and of the movies whose saved scores include them, rather
+    than the whole catalog. Returns the set of movies refreshed.
+
+    A RedisBackend only records the movies rated with ``track_dirty`` set.
+    If the refresh fails partway, the movies not yet saved are marked dirty
+    again, for the next refresh.
+    """
+    dirty = db.take_dirty_movies()
+    pending = set(dirty)
+    try:
+        for movie_id in dirty:
+            pending.update(db.get_movies_similar_to(movie_id))
+        refreshed = set(pending)
+        for movie_id in refreshed:
+            db.save_similarity_scores(movie_id, closest_movies(
+                movie_id, n=n, similarity=similarity))
+            pending.discard(movie_id)
+    except Exception:
+        db.mark_dirty_movies(pending)
+        raise
+    return refreshed
+
+
+class SimilarityRefresher(threading.Thread):
+    """
+    Background thread calling ``refresh_similar_movies`` every ``interval``
+    seconds, until ``stop`` is called.
+    """
+
+    def __init__(self, interval=60, n=10, similarity=sim_pearson):
+        super(SimilarityRefresher, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.n = n
+        self.similarity = similarity
+        self.stopped = threading.Event()
+
+    def run(self):
+        while True:
+            refreshed = refresh_similar_movies(n=self.n,
+                                               similarity=self.similarity)
+            if refreshed:
+                sys.stdout.write("Refreshed {0} movies\n".format(len(refreshed)))
+            if self.stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self.stopped.set()
+
+
+def iter_reviewer_ratings(reviewer_ids, chunk_size=500):
+    """
+    Yields (reviewer_id, ratings) for each of the given reviewers, where
+    ratings is a dict keyed by movie id. Ratings are fetched in bulk, a chunk
+    of reviewers at a time.
+    """
+    reviewer_ids = list(reviewer_ids)
+    for start in range(0, len(reviewer_ids), chunk_size):
+        chunk = reviewer_ids[start:start + chunk_size]
+        ratings = db.get_ratings_for_reviewers(chunk)
+        for reviewer_id in chunk:
+            yield reviewer_id, ratings[int(reviewer_id)]
+
+
+class Rankings(list):
+    """
+    A list of (score, movie_id) recommendations, best first. ``complete`` is
+    False if a time budget ran out before every neighbor was considered.
+    """
+    complete = True
+
+
+def _cached(function):
+    """
+    Decorates a recommendation function to store its results in
+    ``result_cache``, keyed by the user and the rest of its arguments.
+    Results cut short by a time budget are not stored, but a call with a
+    budget can use one that was. Neither are results for a user whose
+    cached results were invalidated while they were being computed.
+    """
+    @functools.wraps(function)
+    def wrapper(reviewer_id, *args, **kwargs):
+        cache = result_cache
+        if cache is None:
+            return function(reviewer_id, *args, **kwargs)
+        arguments = inspect.getcallargs(function, reviewer_id, *args, **kwargs)
+        arguments.pop('budget', None)
+        arguments.pop('matrix', None)
+        key = ":".join([function.__name__] + [
+            "{0}={1}".format(name, getattr(value, '__name__', value))
+            for name, value in sorted(arguments.items())])
+        rankings = cache.get(reviewer_id, key)
+        if rankings is not None:
+            return Rankings(rankings)
+        generation = cache.generation(reviewer_id)
+        rankings = function(reviewer_id, *args, **kwargs)
+        if getattr(rankings, 'complete', True):
+            cache.set(reviewer_id, key, list(rankings), generation)
+        return rankings
+    return wrapper
+
+
+def _scored_neighbors(reviewer_id, ratings, similarity, neighbors=None,
+                      batch=False, prioritize=False, chunk_size=500,
+                      matrix=None):
+    """
+    Yields (sim, other, other_ratings) for the reviewers contributing to a
+    user's recommendations: every other reviewer, or only the ``neighbors``
+    most similar ones, most similar first. With ``prioritize``, every other
+    reviewer is yielded in order of the number of movies they have rated in
+    common with the user, most first.
+    """
+    if neighbors is not None:
+        closest = closest_reviewers(reviewer_id, n=neighbors,
+                                    similarity=similarity, batch=batch,
+                                    matrix=matrix)
+        sims = dict((other, sim) for sim, other in closest)
+        for other, other_ratings in iter_reviewer_ratings(
+                [other for _, other in closest], chunk_size=chunk_size):
+            yield sims[other], other, other_ratings
+        return
+
+    others = [other for other in db.get_reviewers() if other != reviewer_id]
+    if prioritize:
+        counts = co_reviewer_counts(reviewer_id)
+        others.sort(key=lambda other: -counts[other])
+    for other, other_ratings in iter_reviewer_ratings(others, chunk_size=chunk_size):
+        sim = similarity([(rating, other_ratings[movie_id])
+                          for movie_id, rating in ratings.items()
+                          if movie_id in other_ratings])
+        yield sim, other, other_ratings
+
+
+def _score_updates(reviewer_id, similarity=sim_distance, neighbors=None,
+                   batch=False, prioritize=False, chunk_size=500, matrix=None):
+    """
+    Yields, for every reviewer ``_scored_neighbors`` considers, a list of the
+    (score, movie_id) updates their ratings make to the given user's
+    recommendations. The list is empty for reviewers who contribute nothing,
+    so callers still get control back once per reviewer.
     """
     totals = {}  # where totals[movie_id] = sum of (ratings * similarity)
     sim_sums = {}
 
+    ratings = db.get_ratings_for_reviewer(reviewer_id)
     # get movies reviewer hasn't rated
     unrated_movie_ids = db.get_unrated_movies_for(reviewer_id)
 
-    movie_idx = 0
-    for movie_id in unrated_movie_ids:
+    for sim, other, other_ratings in _scored_neighbors(
+            reviewer_id, ratings, similarity, neighbors=neighbors, batch=batch,
+            prioritize=prioritize, chunk_size=chunk_size, matrix=matrix):
+        updates = []
+
+        # ignore scores of zero or lower
+        if sim > 0:
+            for movie_id, rating in other_ratings.items():
+                if movie_id not in unrated_movie_ids:
+                    continue
+
+                # similarity * score
+                totals[movie_id] = totals.get(movie_id, 0) + rating * sim
+                # sum of similarities
+                sim_sums[movie_id] = sim_sums.get(movie_id, 0) + sim
+                updates.append((totals[movie_id] / sim_sums[movie_id], movie_id))
+        yield updates
+
+
+def iter_user_based_scores(reviewer_id, similarity=sim_distance, neighbors=None,
+                           batch=False, prioritize=False, chunk_size=500,
+                           matrix=None):
+    """
+    Yields (score, movie_id) for the given user's recommendations as they are
+    computed. Each time another reviewer's ratings change the score of a movie
+    the user hasn't rated, its new score is yielded, so the last score yielded
+    for a movie is its final one. Arguments are as for
+    ``get_user_based_recommendations`` and ``_scored_neighbors``.
+
+    Callers can stop consuming at any point, and the scores seen so far are
+    those of the reviewers considered so far.
+    """
+    for updates in _score_updates(reviewer_id, similarity=similarity,
+                                  neighbors=neighbors, batch=batch,
+                                  prioritize=prioritize, chunk_size=chunk_size,
+                                  matrix=matrix):
+        for score, movie_id in updates:
+            yield score, movie_id
+
+
+@_cached
+def get_user_based_recommendations(reviewer_id, num=20, similarity=sim_distance,
+                                   neighbors=None, batch=False, budget=None,
+                                   matrix=None):
+    """
+    Get movie recommendations for the given user. Returns the top num movies,
+    using the given similarity function. This function does not make use
+    of any pre-calculated movie similarity scores.
 
-        movie_idx += 1
+    Each other reviewer's similarity to the user is computed exactly once,
+    from their ratings, which are then used to score every movie the user
+    hasn't rated. If ``neighbors`` is given, only that many of the most
+    similar reviewers, as found by ``closest_reviewers`` (in batch mode if
+    ``batch`` is set, over ``matrix``), contribute to the scores. Against
+    Redis, batch mode needs the rating matrix passed in, loaded once with
+    ``db.get_ratings_matrix()``, so that requests don't each read every
+    rating.
 
-        reviewer_ids = db.get_reviewers_for_movie(movie_id)
-        for reviewer in reviewer_ids:
-            sim = get_reviewer_similarity(reviewer_id, reviewer, sim_function=similarity)
+    Given a ``budget`` in seconds, reviewers are considered in order of how
+    much they are likely to contribute, the most similar neighbors or those
+    sharing the most movies first, in small chunks. When the budget runs
+    out, the rankings so far are returned, with ``complete`` set to False.
+    Finding the ``neighbors`` is not interrupted.
+
+    Returns a ``Rankings`` list.
+    """
+    deadline = time.time() + budget if budget is not None else None
+    scores = {}
+    complete = True
+
+    # the deadline is checked once per reviewer, whether or not they
+    # contribute anything
+    for updates in _score_updates(
+            reviewer_id, similarity=similarity, neighbors=neighbors,
+            batch=batch, prioritize=deadline is not None,
+            chunk_size=50 if deadline is not None else 500, matrix=matrix):
+        if deadline is not None and time.time() >= deadline:
+            complete = False
+            break
+        for score, movie_id in updates:
+            scores[movie_id] = score
+
+    # return the sorted list
+    rankings = sorted(((score, movie_id) for movie_id, score in scores.items()),
+                      reverse=True)
+    rankings = Rankings(rankings[:num])
+    rankings.complete = complete
+    return rankings
+
+
+def recommend_many(reviewer_ids, num=20, similarity=sim_distance,
+                   block_size=256):
+    """
+    Yields (reviewer_id, rankings) for each of the given users, with the
+    same rankings as ``get_user_based_recommendations``.
+
+    The rating matrix is loaded once, and users are scored in blocks of
+    ``block_size``: a block's similarities to every reviewer come from a few
+    sparse matrix products, and its movie scores from two more. Only one
+    block's scores are held at a time. Users with no ratings are handed to
+    ``get_user_based_recommendations``.
+
+    Raises ValueError if ``similarity`` has no vectorized counterpart.
+    """
+    from_sums = sums_function(similarity)
+    matrix, ids, movie_ids = db.get_ratings_matrix()
+    matrix = matrix.tocsr()
+    rated = matrix.copy()
+    rated.data = (rated.data != 0).astype(np.float64)
+    movies = db.get_movies()
+    listed = np.array([int(movie_id) in movies for movie_id in movie_ids],
+                      dtype=bool)
+    rows = dict((int(reviewer_id), row) for row, reviewer_id in enumerate(ids))
+    by_reviewer_column = matrix.T.tocsc()
+
+    reviewer_ids = list(reviewer_ids)
+    for start in range(0, len(reviewer_ids), block_size):
+        block = reviewer_ids[start:start + block_size]
+        known = [int(reviewer_id) for reviewer_id in block
+                 if int(reviewer_id) in rows]
+        offsets = dict((reviewer_id, offset)
+                       for offset, reviewer_id in enumerate(known))
+        columns = np.array([rows[reviewer_id] for reviewer_id in known],
+                           dtype=np.int64)
+        if len(columns):
+            # (reviewers x block) similarities, keeping positive ones only
+            sims = from_sums(*pairwise_rating_sums(by_reviewer_column, columns))
+            sims[columns, np.arange(len(columns))] = 0
+            sims = np.where(sims > 0, sims, 0)
+            totals = np.asarray(matrix.T.dot(sims))
+            sim_sums = np.asarray(rated.T.dot(sims))
+        for reviewer_id in block:
+            if int(reviewer_id) not in rows:
+                yield reviewer_id, get_user_based_recommendations(
+                    reviewer_id, num=num, similarity=similarity)
+                continue
+            offset = offsets[int(reviewer_id)]
+            unrated = listed.copy()
+            row = rows[int(reviewer_id)]
+            unrated[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]] = False
+            scored = np.flatnonzero(unrated & (sim_sums[:, offset] > 0))
+            scores = totals[scored, offset] / sim_sums[scored, offset]
+            order = np.lexsort((movie_ids[scored], scores))[::-1][:num]
+            yield reviewer_id, [(float(scores[i]), int(movie_ids[scored[i]]))
+                                for i in order]
+
+
+@_cached
+def get_item_based_recommendations(reviewer_id, num=20):
+    """
+    Get movie recommendations for the given user, using the movie similarity
+    scores saved by ``calculate_similar_movies``. Each movie similar to one
+    the user has rated is scored by the user's ratings, weighted by
+    similarity. Only the user's own ratings and the saved neighbors of the
+    movies they rated are read.
+    """
+    totals = {}  # where totals[movie_id] = sum of (ratings * similarity)
+    sim_sums = {}
+
+    ratings = db.get_ratings_for_reviewer(reviewer_id)
+    similarity_scores = db.get_similarity_scores(ratings.keys())
+
+    for movie_id, rating in ratings.items():
+        for sim, other in similarity_scores[movie_id]:
+
+            # ignore movies the reviewer has already rated
+            if other in ratings:
+                continue
 
             # ignore scores of zero or lower
             if sim <= 0:
                 continue
 
-            rating = db.get_reviewer_rating_for_movie(reviewer, movie_id)
-
             # similarity * score
-            totals.setdefault(movie_id, 0)
-            totals[movie_id] += rating * sim
+            totals.setdefault(other, 0)
+            totals[other] += rating * sim
             # sum of similarities
-            sim_sums.setdefault(movie_id, 0)
-            sim_sums[movie_id] += sim
+            sim_sums.setdefault(other, 0)
+            sim_sums[other] += sim
 
     # create the normalized list
     rankings = [(total / sim_sums[movie_id], movie_id)
@@ -119,4 +700,23 @@ def get_user_based_recommendations(reviewer_id, num=20, similarity=sim_distance)
     # return the sorted list
     rankings.sort()
     rankings.reverse()
-    return rankings[:20]
+    return rankings[:num]
+
+
+def get_model_based_recommendations(reviewer_id, model, num=20, index=None):
+    """
+    Get movie recommendations for the given user from a trained
+    ``factorization.FactorModel``. Every movie is scored with one dot
+    product, and the movies the user has already rated are left out.
+
+    If a ``mips.FactorIndex`` built over the model is given, only the
+    movies it retrieves are scored, trading some recall for speed.
+
+    Users the model was not trained on are folded into it from their
+    current ratings first.
+    """
+    if not model.knows_reviewer(reviewer_id):
+        model.fold_in(reviewer_id, db.get_ratings_for_reviewer(reviewer_id))
+    source = index if index is not None else model
+    return source.recommend(reviewer_id, num=num,
+                            candidates=db.get_unrated_movies_for(reviewer_id))
@@ -0,0 +1,147 @@
+"""
+Caches for recommendation results. Set ``recommendr.result_cache`` to one
+of these to have ``get_user_based_recommendations`` and
+``get_item_based_recommendations`` reuse the result of an identical earlier
+call, until the user rates another movie.
+
+Each user also has a generation, which invalidating their results bumps.
+A result is computed after reading the generation, and only stored if it
+is still the same, so that a result computed from ratings older than an
+invalidation is never stored after it.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+
+class LRUCache(object):
+    """
+    Keeps the results of the ``max_size`` most recently used calls in
+    process memory, each for at most ``ttl`` seconds if ``ttl`` is given.
+    Ratings only invalidate entries if they are added through a backend
+    this cache watches, in this process.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (reviewer_id, key) -> (expiry, value)
+        self._generations = {}  # reviewer_id -> number of invalidations
+        self._lock = threading.Lock()
+
+    def get(self, reviewer_id, key):
+        """
+        Return the cached value, or None.
+        """
+        entry = self._entries.pop((int(reviewer_id), key), None)
+        if entry is None or (entry[0] is not None and entry[0] < time.time()):
+            return None
+        self._entries[(int(reviewer_id), key)] = entry
+        return entry[1]
+
+    def generation(self, reviewer_id):
+        """
+        Return the user's current generation.
+        """
+        return self._generations.get(int(reviewer_id), 0)
+
+    def set(self, reviewer_id, key, value, generation=None):
+        """
+        Store a value, unless a ``generation`` is given and the user's
+        results have been invalidated since it was read.
+        """
+        reviewer_id = int(reviewer_id)
+        with self._lock:
+            if generation is not None and generation != self.generation(reviewer_id):
+                return
+            self._entries.pop((reviewer_id, key), None)
+            expiry = time.time() + self.ttl if self.ttl is not None else None
+            self._entries[(reviewer_id, key)] = (expiry, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, reviewer_id):
+        """
+        Drop every cached result for the given user.
+        """
+        reviewer_id = int(reviewer_id)
+        with self._lock:
+            self._generations[reviewer_id] = self.generation(reviewer_id) + 1
+            for entry in [entry for entry in self._entries
+                          if entry[0] == reviewer_id]:
+                del self._entries[entry]
+
+    def watch(self, backend):
+        """
+        Invalidate a user's results whenever a rating is added for them
+        through the given backend.
+        """
+        backend.add_rating_listener(
+            lambda reviewer_id, movie_id, rating: self.invalidate(reviewer_id))
+
+
+class RedisCache(object):
+    """
+    Keeps results in Redis, shared by every process, in one hash per user
+    that expires ``ttl`` seconds after it was last written. When a
+    RedisBackend on the same database, created with ``invalidate_cache``,
+    adds a rating, it deletes the user's hash and bumps their generation in
+    the same transaction, in whichever process it runs.
+    """
+
+    def __init__(self, client, ttl=300):
+        self.redis = client
+        self.ttl = ttl
+
+    def _key(self, reviewer_id):
+        return "uid:{0}:recommendations".format(reviewer_id)
+
+    def _generation_key(self, reviewer_id):
+        return "uid:{0}:recgen".format(reviewer_id)
+
+    def generation(self, reviewer_id):
+        """
+        Return the user's current generation.
+        """
+        return int(self.redis.get(self._generation_key(reviewer_id)) or 0)
+
+    def get(self, reviewer_id, key):
+        """
+        Return the cached value, or None.
+        """
+        value = self.redis.hget(self._key(reviewer_id), key)
+        if value is None:
+            return None
+        return [tuple(ranking) for ranking in json.loads(value)]
+
+    def set(self, reviewer_id, key, value, generation=None):
+        """
+        Store a value, unless a ``generation`` is given and the user's
+        results have been invalidated since it was read.
+        """
+        generation_key = self._generation_key(reviewer_id)
+        with self.redis.pipeline() as pipe:
+            try:
+                # a rating added after this check aborts the transaction
+                pipe.watch(generation_key)
+                if (generation is not None and
+                        generation != int(pipe.get(generation_key) or 0)):
+                    return
+                pipe.multi()
+                pipe.hset(self._key(reviewer_id), key, json.dumps(value))
+                pipe.expire(self._key(reviewer_id), self.ttl)
+                pipe.execute()
+            except redis.WatchError:
+                pass
+
+    def invalidate(self, reviewer_id):
+        """
+        Drop every cached result for the given user.
+        """
+        with self.redis.pipeline() as pipe:
+            pipe.incr(self._generation_key(reviewer_id))
+            pipe.delete(self._key(reviewer_id))
+            pipe.execute()
@@ -18,3 +18,11 @@ def get_env_var(varname, default=None):
 REDIS_HOST = get_env_var("REDIS_HOST", 'localhost')
 REDIS_PORT = int(get_env_var("REDIS_PORT", 6379))
 REDIS_DB = int(get_env_var("REDIS_DB", 1))
+# Comma separated: 'movies' and/or 'reviewers'. See RedisBackend.
+REDIS_PAIR_STATS = tuple(name.strip() for name in
+                         get_env_var("REDIS_PAIR_STATS", '').split(',')
+                         if name.strip())
+# Set to 1 to track the movies rated since the last similarity refresh.
+REDIS_TRACK_DIRTY = get_env_var("REDIS_TRACK_DIRTY", '0') == '1'
+# Set to 1 to drop a user's RedisCache results when they add a rating.
+REDIS_INVALIDATE_CACHE = get_env_var("REDIS_INVALIDATE_CACHE", '0') == '1'
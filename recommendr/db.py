@@ -1,9 +1,63 @@
 """
-Persistant storage for movies and reviews, using Redis.
+Persistant storage for movies and reviews, using Redis. An in-process
+backend with the same interface is provided for batch jobs and testing.
 """
+import numpy as np
 import redis
+from scipy import sparse
 
 from . import config
+from .similarity import sim_pearson, sim_distance, SUMS_FUNCTIONS
+
+
+# Lua prologue shared by the similarity scripts. Accumulates the sums needed
+# by the similarity functions over the members common to the sorted sets
+# KEYS[1] and KEYS[2], walking the smaller of the two.
+COMMON_SUMS_LUA = """
+local key_1, key_2 = KEYS[1], KEYS[2]
+if redis.call('ZCARD', key_1) > redis.call('ZCARD', key_2) then
+    key_1, key_2 = key_2, key_1
+end
+local scores = redis.call('ZRANGE', key_1, 0, -1, 'WITHSCORES')
+local n, sum_1, sum_2, sum_1_sq, sum_2_sq, sum_of_products = 0, 0, 0, 0, 0, 0
+local sum_of_squares = 0
+for i = 1, #scores, 2 do
+    local other = redis.call('ZSCORE', key_2, scores[i])
+    if other then
+        local rating_1, rating_2 = tonumber(scores[i + 1]), tonumber(other)
+        n = n + 1
+        sum_1 = sum_1 + rating_1
+        sum_2 = sum_2 + rating_2
+        sum_1_sq = sum_1_sq + rating_1 * rating_1
+        sum_2_sq = sum_2_sq + rating_2 * rating_2
+        sum_of_products = sum_of_products + rating_1 * rating_2
+        sum_of_squares = sum_of_squares + (rating_1 - rating_2) ^ 2
+    end
+end
+"""
+
+# Redis truncates Lua numbers to integers, so scores are returned as strings.
+SIM_DISTANCE_LUA = COMMON_SUMS_LUA + """
+return string.format('%.17g', 1 / (1 + math.sqrt(sum_of_squares)))
+"""
+
+SIM_PEARSON_LUA = COMMON_SUMS_LUA + """
+if n == 0 then
+    return '0'
+end
+local numerator = sum_of_products - (sum_1 * sum_2 / n)
+local denominator = math.sqrt((sum_1_sq - sum_1 ^ 2 / n) *
+                              (sum_2_sq - sum_2 ^ 2 / n))
+if denominator == 0 then
+    return '0'
+end
+return string.format('%.17g', numerator / denominator)
+"""
+
+SIMILARITY_SCRIPTS = {
+    sim_distance: SIM_DISTANCE_LUA,
+    sim_pearson: SIM_PEARSON_LUA,
+}
 
 
 def int_or_none(value):
@@ -23,18 +77,120 @@ def set_to_ints(values):
     return set(ints)
 
 
+def scores_to_dict(scores):
+    """
+    Convert a list of (member, score) pairs, as returned by ZRANGE with
+    WITHSCORES, to a dict keyed by integer member.
+    """
+    return dict((int(member), score) for member, score in scores)
+
+
+def ratings_to_matrix(ratings):
+    """
+    Convert ratings given as a dict of dicts, keyed by reviewer id and then
+    movie id, to a sparse (reviewers x movies) matrix. Returns a tuple of
+    (matrix, reviewer_ids, movie_ids), where the id arrays give the reviewer
+    for each row and the movie for each column.
+    """
+    reviewer_ids = np.array(sorted(ratings), dtype=np.int64)
+    movie_ids = set()
+    for reviews in ratings.values():
+        movie_ids.update(reviews)
+    movie_ids = np.array(sorted(movie_ids), dtype=np.int64)
+    movie_index = dict((movie_id, col) for col, movie_id in
+                       enumerate(movie_ids.tolist()))
+    rows, cols, data = [], [], []
+    for row, reviewer_id in enumerate(reviewer_ids.tolist()):
+        for movie_id, rating in ratings[reviewer_id].items():
+            rows.append(row)
+            cols.append(movie_index[movie_id])
+            data.append(rating)
+    matrix = sparse.csr_matrix((np.array(data, dtype=np.float64), (rows, cols)),
+                               shape=(len(reviewer_ids), len(movie_ids)))
+    return matrix, reviewer_ids, movie_ids
+
+
+def _connect(connection_class, connection_kwargs, options):
+    """
+    Return a RedisBackend on a new connection pool with the given settings,
+    and the given keyword arguments.
+    """
+    client = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+        connection_class=connection_class, **connection_kwargs))
+    return RedisBackend(client=client, **options)
+
+
 class RedisBackend(object):
     """
     Movie database storage and access functions, backed by Redis. Currently,
     only 'create' and 'retrieve' type functions are implemented.
+
+    When ``lua_similarity`` is set, similarity scores for the functions in
+    ``SIMILARITY_SCRIPTS`` are computed inside Redis by Lua scripts, and only
+    the final score is sent back.
+
+    ``pair_stats`` may contain 'movies' and/or 'reviewers'. For each, every
+    ``add_rating`` call also updates the running sums (count, sums, sums of
+    squares and sum of products) of the co-ratings of each affected pair,
+    from which the similarity of any pair can then be read in O(1). Only
+    ratings added while enabled are counted, so enable it before importing.
+
+    When ``track_dirty`` is set, every ``add_rating`` call also adds the
+    movie to the set returned by ``take_dirty_movies``, from which
+    ``refresh_similar_movies`` works. It's off by default, so that bulk
+    imports don't pay for it.
+
+    When ``invalidate_cache`` is set, every ``add_rating`` call also drops
+    the user's results from a ``cache.RedisCache`` on the same database,
+    and bumps their generation, so that results computed before the rating
+    aren't stored after it. Set it whenever a RedisCache is in use.
     """
 
+    # get_ratings_matrix reads every rating from Redis
+    in_memory = False
+
     def __init__(self, host=config.REDIS_HOST, port=config.REDIS_PORT,
-                 db=config.REDIS_DB, client=None):
+                 db=config.REDIS_DB, client=None, lua_similarity=True,
+                 pair_stats=(), track_dirty=False, invalidate_cache=False):
         if client:
             self.redis = client
         else:
             self.redis = redis.StrictRedis(host=host, port=port, db=db)
+        self.lua_similarity = lua_similarity
+        self.pair_stats = frozenset(pair_stats)
+        self.track_dirty = track_dirty
+        self.invalidate_cache = invalidate_cache
+        self._scripts = {}
+        self._rating_listeners = []
+
+    def clone(self):
+        """
+        Return a new backend with its own connection to the same database,
+        for use in another process.
+        """
+        return _connect(*self.__reduce__()[1])
+
+    def __reduce__(self):
+        # a live connection can't be pickled, so an unpickled backend opens
+        # its own, with the same settings, as clone() does
+        pool = self.redis.connection_pool
+        return _connect, (pool.connection_class, pool.connection_kwargs,
+                          dict(lua_similarity=self.lua_similarity,
+                               pair_stats=self.pair_stats,
+                               track_dirty=self.track_dirty,
+                               invalidate_cache=self.invalidate_cache))
+
+    def _get_script(self, sim_function):
+        """
+        Return the registered Lua script for a similarity function, or None
+        if it has to be computed client-side.
+        """
+        if not self.lua_similarity or sim_function not in SIMILARITY_SCRIPTS:
+            return None
+        if sim_function not in self._scripts:
+            self._scripts[sim_function] = self.redis.register_script(
+                SIMILARITY_SCRIPTS[sim_function])
+        return self._scripts[sim_function]
 
     def clear(self):
         """
@@ -101,28 +257,189 @@ class RedisBackend(object):
         """
         return self.redis.hget("movie_id:{0}".format(movie_id), "name")
 
+    def get_names_for_movies(self, movie_ids, chunk_size=500):
+        """
+        Return a dict of movie names keyed by movie id, for the given movies.
+        Names are fetched with one pipelined round trip per ``chunk_size``
+        movies.
+        """
+        movie_ids = list(movie_ids)
+        names = {}
+        for start in range(0, len(movie_ids), chunk_size):
+            chunk = movie_ids[start:start + chunk_size]
+            with self.redis.pipeline(transaction=False) as pipe:
+                for movie_id in chunk:
+                    pipe.hget("movie_id:{0}".format(movie_id), "name")
+                results = pipe.execute()
+            for movie_id, name in zip(chunk, results):
+                names[int(movie_id)] = name
+        return names
+
     def add_rating(self, reviewer_id, movie_id, rating):
         """
-        Add a movie rating.
+        Add a movie rating. If pair statistics are enabled, the running sums
+        of every affected pair are updated in the same transaction.
         """
+        if not self.pair_stats:
+            with self.redis.pipeline() as pipe:
+                self._queue_rating(pipe, reviewer_id, movie_id, rating)
+                pipe.execute()
+            self._notify_rating(reviewer_id, movie_id, rating)
+            return
+
+        reviews_key = "uid:{0}:reviews".format(reviewer_id)
+        movie_reviews_key = "movie:{0}:reviews".format(movie_id)
         with self.redis.pipeline() as pipe:
-            pipe.sadd("users", reviewer_id)
-            pipe.sadd("uid:{0}:reviewed".format(reviewer_id), movie_id)
-            pipe.zadd("uid:{0}:reviews".format(reviewer_id), rating, movie_id)
-            pipe.sadd("movie:{0}:reviewers".format(movie_id), reviewer_id)
-            pipe.zadd("movie:{0}:reviews".format(movie_id), rating, reviewer_id)
-            pipe.execute()
+            while True:
+                try:
+                    pipe.watch(reviews_key, movie_reviews_key)
+                    previous = pipe.zscore(reviews_key, movie_id)
+                    movie_ratings = reviewer_ratings = {}
+                    if 'movies' in self.pair_stats:
+                        movie_ratings = scores_to_dict(
+                            pipe.zrange(reviews_key, 0, -1, withscores=True))
+                    if 'reviewers' in self.pair_stats:
+                        reviewer_ratings = scores_to_dict(
+                            pipe.zrange(movie_reviews_key, 0, -1, withscores=True))
+                    pipe.multi()
+                    self._queue_rating(pipe, reviewer_id, movie_id, rating)
+                    self._queue_pair_stats(pipe, "movie_pair", movie_id, rating,
+                                           previous, movie_ratings)
+                    self._queue_pair_stats(pipe, "uid_pair", reviewer_id, rating,
+                                           previous, reviewer_ratings)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        self._notify_rating(reviewer_id, movie_id, rating)
+
+    def add_rating_listener(self, listener):
+        """
+        Call ``listener(reviewer_id, movie_id, rating)`` after every rating
+        added through this backend.
+        """
+        self._rating_listeners.append(listener)
+
+    def _notify_rating(self, reviewer_id, movie_id, rating):
+        for listener in self._rating_listeners:
+            listener(reviewer_id, movie_id, rating)
+
+    def _queue_rating(self, pipe, reviewer_id, movie_id, rating):
+        pipe.sadd("users", reviewer_id)
+        pipe.sadd("uid:{0}:reviewed".format(reviewer_id), movie_id)
+        pipe.zadd("uid:{0}:reviews".format(reviewer_id), rating, movie_id)
+        pipe.sadd("movie:{0}:reviewers".format(movie_id), reviewer_id)
+        pipe.zadd("movie:{0}:reviews".format(movie_id), rating, reviewer_id)
+        if self.track_dirty:
+            # mark the movie's saved similarity scores as stale
+            pipe.sadd("movies:dirty", movie_id)
+        if self.invalidate_cache:
+            # drop the reviewer's cached recommendations (see cache.RedisCache)
+            pipe.incr("uid:{0}:recgen".format(reviewer_id))
+            pipe.delete("uid:{0}:recommendations".format(reviewer_id))
+
+    def _queue_pair_stats(self, pipe, prefix, item_id, rating, previous, others):
+        """
+        Queue the updates to the running sums of each pair of item_id and an
+        item in ``others``, a dict of the ratings co-rated with ``rating``.
+        ``previous`` is the rating being replaced, if any.
+        """
+        item_id, rating = int(item_id), float(rating)
+        if previous is not None and float(previous) == rating:
+            return
+        for other_id, other_rating in others.items():
+            if other_id == item_id:
+                continue
+            key = "{0}:{1}:{2}".format(prefix, min(item_id, other_id),
+                                       max(item_id, other_id))
+            own, other = ('1', '2') if item_id < other_id else ('2', '1')
+            if previous is None:
+                old = 0
+                pipe.hincrbyfloat(key, 'count', 1)
+                pipe.hincrbyfloat(key, 'sum_' + other, other_rating)
+                pipe.hincrbyfloat(key, 'sum_{0}_sq'.format(other),
+                                  other_rating ** 2)
+            else:
+                old = float(previous)
+            pipe.hincrbyfloat(key, 'sum_' + own, rating - old)
+            pipe.hincrbyfloat(key, 'sum_{0}_sq'.format(own), rating ** 2 - old ** 2)
+            pipe.hincrbyfloat(key, 'sum_of_products', (rating - old) * other_rating)
+
+    def _get_pair_stats(self, prefix, id_1, id_2):
+        """
+        Return the running sums for a pair, ordered as the output of
+        ``similarity.rating_sums`` with id_1 as the first side.
+        """
+        id_1, id_2 = int(id_1), int(id_2)
+        key = "{0}:{1}:{2}".format(prefix, min(id_1, id_2), max(id_1, id_2))
+        values = self.redis.hmget(key, 'count', 'sum_1', 'sum_2', 'sum_1_sq',
+                                  'sum_2_sq', 'sum_of_products')
+        count, sum_1, sum_2, sum_1_sq, sum_2_sq, sum_of_products = [
+            float(value or 0) for value in values]
+        if id_1 > id_2:
+            sum_1, sum_2, sum_1_sq, sum_2_sq = sum_2, sum_1, sum_2_sq, sum_1_sq
+        return count, sum_1, sum_2, sum_1_sq, sum_2_sq, sum_of_products
 
     def save_similarity_scores(self, movie, scores):
         """
-        Persist calculated similarity scores to Redis. Expects ``scores`` as a
-        list of two tuples of (score, movie_id)
+        Persist calculated similarity scores to Redis, replacing any saved
+        before. Expects ``scores`` as a list of two tuples of (score, movie_id)
+
+        Each listed movie's ``movie:{id}:similar_to`` set records that it
+        appears in this movie's list.
         """
+        key = "movie:{0}:similarities".format(movie)
+        previous = self.redis.zrange(key, 0, -1)
         with self.redis.pipeline() as pipe:
+            for movie_id in previous:
+                pipe.srem("movie:{0}:similar_to".format(int(movie_id)), movie)
+            pipe.delete(key)
             for score, movie_id in scores:
-                pipe.zadd("movie:{0}:similarities".format(movie), score, movie_id)
+                pipe.zadd(key, score, movie_id)
+                pipe.sadd("movie:{0}:similar_to".format(movie_id), movie)
             pipe.execute()
 
+    def get_movies_similar_to(self, movie_id):
+        """
+        Return the set of movies whose saved similarity scores include the
+        given movie.
+        """
+        movies = self.redis.smembers("movie:{0}:similar_to".format(movie_id))
+        return set_to_ints(movies)
+
+    def take_dirty_movies(self):
+        """
+        Return the set of movies rated since the last call, and clear it.
+        """
+        with self.redis.pipeline() as pipe:
+            pipe.smembers("movies:dirty")
+            pipe.delete("movies:dirty")
+            movies = pipe.execute()[0]
+        return set_to_ints(movies)
+
+    def mark_dirty_movies(self, movie_ids):
+        """
+        Add movies to the set returned by ``take_dirty_movies``.
+        """
+        movie_ids = list(movie_ids)
+        if movie_ids:
+            self.redis.sadd("movies:dirty", *movie_ids)
+
+    def get_similarity_scores(self, movie_ids):
+        """
+        Retrieve the saved similarity scores for each of the given movies, in
+        one pipelined round trip. Returns a dict keyed by movie id, of lists
+        of (score, movie_id) two tuples, highest score first.
+        """
+        movie_ids = list(movie_ids)
+        with self.redis.pipeline(transaction=False) as pipe:
+            for movie_id in movie_ids:
+                pipe.zrevrange("movie:{0}:similarities".format(movie_id), 0, -1,
+                               withscores=True)
+            results = pipe.execute()
+        return dict((int(movie_id), [(score, int(other)) for other, score in scores])
+                    for movie_id, scores in zip(movie_ids, results))
+
     def get_unrated_movies_for(self, reviewer_id):
         """
         Return a set of movie ids that the given reviewer has not yet rated.
@@ -146,38 +463,563 @@ class RedisBackend(object):
         users = self.redis.smembers("movie:{0}:reviewers".format(movie_id))
         return set_to_ints(users)
 
+    def get_reviewers_for_movies(self, movie_ids):
+        """
+        Return the set of reviewers of each of the given movies, as a dict
+        keyed by movie id, in one pipelined round trip.
+        """
+        movie_ids = list(movie_ids)
+        with self.redis.pipeline(transaction=False) as pipe:
+            for movie_id in movie_ids:
+                pipe.smembers("movie:{0}:reviewers".format(movie_id))
+            results = pipe.execute()
+        return dict((int(movie_id), set_to_ints(users))
+                    for movie_id, users in zip(movie_ids, results))
+
     def get_reviewer_rating_for_movie(self, reviewer_id, movie_id):
         """
         Retrieve the reviewer's rating for the given movie.
         """
         return self.redis.zscore("uid:{0}:reviews".format(reviewer_id), movie_id)
 
+    def get_ratings_for_reviewer(self, reviewer_id):
+        """
+        Return every rating made by the given reviewer, as a dict keyed by
+        movie id.
+        """
+        scores = self.redis.zrange("uid:{0}:reviews".format(reviewer_id), 0, -1,
+                                   withscores=True)
+        return scores_to_dict(scores)
+
+    def get_ratings_for_reviewers(self, reviewer_ids, chunk_size=500):
+        """
+        Return every rating made by the given reviewers, as a dict of dicts
+        keyed by reviewer id and then movie id. Ratings are fetched with one
+        pipelined round trip per ``chunk_size`` reviewers.
+        """
+        reviewer_ids = list(reviewer_ids)
+        ratings = {}
+        for start in range(0, len(reviewer_ids), chunk_size):
+            chunk = reviewer_ids[start:start + chunk_size]
+            with self.redis.pipeline(transaction=False) as pipe:
+                for reviewer_id in chunk:
+                    pipe.zrange("uid:{0}:reviews".format(reviewer_id), 0, -1,
+                                withscores=True)
+                results = pipe.execute()
+            for reviewer_id, scores in zip(chunk, results):
+                ratings[int(reviewer_id)] = scores_to_dict(scores)
+        return ratings
+
+    def _get_common_scores(self, key_1, key_2):
+        """
+        Return (score_1, score_2) tuples for every member of both sorted sets.
+        The intersection is built server-side with ZINTERSTORE, once weighted
+        towards each set, so everything is fetched in a single round trip.
+        """
+        tmp_1 = "tmp:common:{0}:{1}:1".format(key_1, key_2)
+        tmp_2 = "tmp:common:{0}:{1}:2".format(key_1, key_2)
+        with self.redis.pipeline() as pipe:
+            pipe.zinterstore(tmp_1, {key_1: 1, key_2: 0})
+            pipe.zinterstore(tmp_2, {key_1: 0, key_2: 1})
+            pipe.zrange(tmp_1, 0, -1, withscores=True)
+            pipe.zrange(tmp_2, 0, -1, withscores=True)
+            pipe.delete(tmp_1, tmp_2)
+            scores_1, scores_2 = pipe.execute()[2:4]
+        scores_1 = dict(scores_1)
+        return [(scores_1[member], score_2) for member, score_2 in scores_2]
+
+    def get_ratings_matrix(self):
+        """
+        Load every rating into a sparse (reviewers x movies) matrix. Returns a
+        tuple of (matrix, reviewer_ids, movie_ids), as ``ratings_to_matrix``.
+        """
+        return ratings_to_matrix(
+            self.get_ratings_for_reviewers(self.get_reviewers()))
+
+    def save_lsh_signatures(self, signatures):
+        """
+        Store reviewers' locality-sensitive hash signatures, given as a dict
+        keyed by reviewer id of lists of bucket numbers, one per table. Each
+        reviewer is added to its buckets, and removed from the buckets of any
+        signature saved before.
+        """
+        reviewer_ids = list(signatures)
+        if not reviewer_ids:
+            return
+        previous = self.redis.hmget("lsh:signatures", reviewer_ids)
+        with self.redis.pipeline() as pipe:
+            for reviewer_id, old in zip(reviewer_ids, previous):
+                if old is not None:
+                    for table, bucket in enumerate(old.split(b',')):
+                        pipe.srem("lsh:{0}:{1}".format(table, int(bucket)),
+                                  reviewer_id)
+                signature = signatures[reviewer_id]
+                for table, bucket in enumerate(signature):
+                    key = "lsh:{0}:{1}".format(table, bucket)
+                    pipe.sadd(key, reviewer_id)
+                    pipe.sadd("lsh:buckets", key)
+                pipe.hset("lsh:signatures", reviewer_id,
+                          ",".join(str(bucket) for bucket in signature))
+            pipe.execute()
+
+    def get_lsh_candidates(self, signature):
+        """
+        Return the set of reviewers sharing any of the given signature's
+        buckets.
+        """
+        keys = ["lsh:{0}:{1}".format(table, bucket)
+                for table, bucket in enumerate(signature)]
+        return set_to_ints(self.redis.sunion(keys))
+
+    def clear_lsh_signatures(self):
+        """
+        Remove all stored locality-sensitive hash signatures.
+        """
+        buckets = self.redis.smembers("lsh:buckets")
+        with self.redis.pipeline() as pipe:
+            for key in buckets:
+                pipe.delete(key)
+            pipe.delete("lsh:buckets", "lsh:signatures")
+            pipe.execute()
+
     def get_common_ratings_for_reviewers(self, reviewer_id_1, reviewer_id_2):
         """
         Returns a list of ratings for all movies that both reviewer_id_1 and
         reviewer_id_2 have rated, as tuples.
         """
-        common_movies = self.redis.sinter("uid:{0}:reviewed".format(reviewer_id_1),
-                                  "uid:{0}:reviewed".format(reviewer_id_2))
-        ratings = []
-        for movie_id in common_movies:
-            reviewer_1_rating = self.redis.zscore("uid:{0}:reviews".format(reviewer_id_1), movie_id)
-            reviewer_2_rating = self.redis.zscore("uid:{0}:reviews".format(reviewer_id_2), movie_id)
-            if reviewer_1_rating is not None and reviewer_2_rating is not None:
-                ratings.append((reviewer_1_rating, reviewer_2_rating))
-        return ratings
+        return self._get_common_scores("uid:{0}:reviews".format(reviewer_id_1),
+                                       "uid:{0}:reviews".format(reviewer_id_2))
 
     def get_common_ratings_for_movies(self, movie_1, movie_2):
         """
         Returns a list of ratings for all reviewers that have reviewed both
         movie_1 and movie_2, as tuples
         """
-        common_reviewers = self.redis.sinter("movie:{0}:reviewers".format(movie_1),
-                                     "movie:{0}:reviewers".format(movie_2))
-        ratings = []
-        for reviewer in common_reviewers:
-            movie_1_rating = self.redis.zscore("movie:{0}:reviews".format(movie_1), reviewer)
-            movie_2_rating = self.redis.zscore("movie:{0}:reviews".format(movie_2), reviewer)
-            if movie_1_rating is not None and movie_2_rating is not None:
-                ratings.append((movie_1_rating, movie_2_rating))
-        return ratings
+        return self._get_common_scores("movie:{0}:reviews".format(movie_1),
+                                       "movie:{0}:reviews".format(movie_2))
+
+    def get_similarity_for_reviewers(self, reviewer_id_1, reviewer_id_2,
+                                     sim_function=sim_pearson):
+        """
+        Returns the similarity score for two reviewers, read from the running
+        pair sums if they are maintained, or else computed server-side if
+        possible.
+        """
+        if 'reviewers' in self.pair_stats and sim_function in SUMS_FUNCTIONS:
+            return float(SUMS_FUNCTIONS[sim_function](
+                *self._get_pair_stats("uid_pair", reviewer_id_1, reviewer_id_2)))
+        script = self._get_script(sim_function)
+        if script is None:
+            return sim_function(self.get_common_ratings_for_reviewers(
+                reviewer_id_1, reviewer_id_2))
+        return float(script(keys=["uid:{0}:reviews".format(reviewer_id_1),
+                                  "uid:{0}:reviews".format(reviewer_id_2)]))
+
+    def get_similarity_for_movies(self, movie_1, movie_2,
+                                  sim_function=sim_pearson):
+        """
+        Returns the similarity score for two movies, read from the running
+        pair sums if they are maintained, or else computed server-side if
+        possible.
+        """
+        if 'movies' in self.pair_stats and sim_function in SUMS_FUNCTIONS:
+            return float(SUMS_FUNCTIONS[sim_function](
+                *self._get_pair_stats("movie_pair", movie_1, movie_2)))
+        script = self._get_script(sim_function)
+        if script is None:
+            return sim_function(self.get_common_ratings_for_movies(movie_1,
+                                                                   movie_2))
+        return float(script(keys=["movie:{0}:reviews".format(movie_1),
+                                  "movie:{0}:reviews".format(movie_2)]))
+
+
+class MemoryBackend(object):
+    """
+    Movie database held entirely in process memory. Ratings are stored as a
+    compressed sparse row matrix (one row per reviewer) and its compressed
+    sparse column counterpart (one column per movie), keyed by dense integer
+    indices, so lookups never leave the process.
+
+    New ratings are buffered and merged into the matrices the next time
+    they are read.
+    """
+
+    # get_ratings_matrix returns the matrix already held
+    in_memory = True
+
+    def __init__(self):
+        self._rating_listeners = []
+        self.clear()
+
+    @classmethod
+    def from_backend(cls, backend):
+        """
+        Build a snapshot of the movies and ratings held by another backend,
+        typically a RedisBackend.
+        """
+        memory = cls()
+        names = backend.get_names_for_movies(backend.get_movies())
+        for movie_id, name in names.items():
+            memory.add_movie(movie_id, name)
+        ratings = backend.get_ratings_for_reviewers(backend.get_reviewers())
+        for reviewer_id, reviews in ratings.items():
+            for movie_id, rating in reviews.items():
+                memory.add_rating(reviewer_id, movie_id, rating)
+        return memory
+
+    def clone(self):
+        """
+        Return a backend for use in another process. Reads are served from
+        this same snapshot, which forked worker processes share
+        copy-on-write.
+        """
+        self._compact()
+        return self
+
+    def __getstate__(self):
+        # rating listeners belong to this process, and may not be picklable
+        self._compact()
+        state = dict(self.__dict__)
+        state['_rating_listeners'] = []
+        return state
+
+    def clear(self):
+        """
+        Removes everything in the database.
+        """
+        self._genres = {}  # genre name -> genre id
+        self._movies = {}  # movie id -> name
+        self._movie_genres = {}  # movie id -> set of genre ids
+        self._similarities = {}  # movie id -> {movie id: score}
+        self._dirty = set()  # movies rated since the last take_dirty_movies
+        self._lsh_signatures = {}  # reviewer id -> bucket per table
+        self._lsh_buckets = {}  # (table, bucket) -> set of reviewer ids
+
+        self._reviewer_index = {}  # reviewer id -> row
+        self._movie_index = {}  # movie id -> column
+        self._reviewer_ids = np.zeros(0, dtype=np.int64)
+        self._movie_ids = np.zeros(0, dtype=np.int64)
+        self._pending = {}  # (row, column) -> rating, not yet in the matrices
+        self._by_reviewer = sparse.csr_matrix((0, 0))
+        self._by_movie = sparse.csc_matrix((0, 0))
+
+    def _index_for(self, index, value):
+        if value not in index:
+            index[value] = len(index)
+        return index[value]
+
+    def _compact(self):
+        """
+        Merge buffered ratings into the CSR and CSC matrices.
+        """
+        shape = (len(self._reviewer_index), len(self._movie_index))
+        if not self._pending and self._by_reviewer.shape == shape:
+            return
+        keys = np.array(list(self._pending.keys()), dtype=np.int64)
+        keys = keys.reshape(-1, 2)
+        values = np.array(list(self._pending.values()), dtype=np.float64)
+
+        existing = self._by_reviewer.tocoo()
+        rows = existing.row.astype(np.int64)
+        cols = existing.col.astype(np.int64)
+        # drop existing ratings that have been overwritten
+        overwritten = np.sort(keys[:, 0] * shape[1] + keys[:, 1])
+        existing_keys = rows * shape[1] + cols
+        keep = np.ones(len(existing_keys), dtype=bool)
+        if len(overwritten):
+            positions = np.minimum(np.searchsorted(overwritten, existing_keys),
+                                   len(overwritten) - 1)
+            keep = overwritten[positions] != existing_keys
+        rows = np.concatenate([rows[keep], keys[:, 0]])
+        cols = np.concatenate([cols[keep], keys[:, 1]])
+        data = np.concatenate([existing.data[keep], values])
+
+        self._by_reviewer = sparse.csr_matrix((data, (rows, cols)), shape=shape)
+        self._by_reviewer.sort_indices()
+        self._by_movie = self._by_reviewer.tocsc()
+        self._by_movie.sort_indices()
+
+        self._reviewer_ids = np.zeros(shape[0], dtype=np.int64)
+        for reviewer_id, row in self._reviewer_index.items():
+            self._reviewer_ids[row] = reviewer_id
+        self._movie_ids = np.zeros(shape[1], dtype=np.int64)
+        for movie_id, col in self._movie_index.items():
+            self._movie_ids[col] = movie_id
+        self._pending = {}
+
+    def _reviewer_row(self, reviewer_id):
+        """
+        Return the (movie columns, ratings) arrays for a reviewer.
+        """
+        self._compact()
+        row = self._reviewer_index.get(int(reviewer_id))
+        if row is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        matrix = self._by_reviewer
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        return matrix.indices[start:end], matrix.data[start:end]
+
+    def _movie_column(self, movie_id):
+        """
+        Return the (reviewer rows, ratings) arrays for a movie.
+        """
+        self._compact()
+        col = self._movie_index.get(int(movie_id))
+        if col is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        matrix = self._by_movie
+        start, end = matrix.indptr[col], matrix.indptr[col + 1]
+        return matrix.indices[start:end], matrix.data[start:end]
+
+    def add_genre(self, name):
+        """
+        Add a new genre. Returns the genre id.
+        """
+        name = name.lower().strip()
+        genre_id = len(self._genres) + 1
+        self._genres[name] = genre_id
+        return genre_id
+
+    def get_genre_id_by_name(self, name):
+        """
+        Given a genre name, return the id.
+        """
+        return self._genres.get(name.lower().strip())
+
+    def get_or_create_genre(self, name):
+        """
+        Always return a genre id given a genre name. If the genre
+        does not exist, create it and return the id.
+        """
+        genre_id = self.get_genre_id_by_name(name)
+        if genre_id is None:
+            genre_id = self.add_genre(name)
+        return genre_id
+
+    def add_movie(self, movie_id, name, *genres):
+        """
+        Add a movie. Movie IDs are not created automatically, they must be
+        specified.
+        """
+        movie_id = int(movie_id)
+        self._movies[movie_id] = name
+        self._index_for(self._movie_index, movie_id)
+        self._movie_genres.setdefault(movie_id, set()).update(genres)
+
+    def get_movies(self):
+        """
+        Return all movie ids.
+        """
+        return set(self._movies)
+
+    def get_name_for_movie(self, movie_id):
+        """
+        Retrieve the name of a movie for a given movie id.
+        """
+        return self._movies.get(int(movie_id))
+
+    def get_names_for_movies(self, movie_ids):
+        """
+        Return a dict of movie names keyed by movie id, for the given movies.
+        """
+        return dict((int(movie_id), self._movies.get(int(movie_id)))
+                    for movie_id in movie_ids)
+
+    def add_rating(self, reviewer_id, movie_id, rating):
+        """
+        Add a movie rating.
+        """
+        row = self._index_for(self._reviewer_index, int(reviewer_id))
+        col = self._index_for(self._movie_index, int(movie_id))
+        self._pending[(row, col)] = float(rating)
+        self._dirty.add(int(movie_id))
+        self._notify_rating(reviewer_id, movie_id, rating)
+
+    def add_rating_listener(self, listener):
+        """
+        Call ``listener(reviewer_id, movie_id, rating)`` after every rating
+        added through this backend.
+        """
+        self._rating_listeners.append(listener)
+
+    def _notify_rating(self, reviewer_id, movie_id, rating):
+        for listener in self._rating_listeners:
+            listener(reviewer_id, movie_id, rating)
+
+    def save_similarity_scores(self, movie, scores):
+        """
+        Store calculated similarity scores, replacing any stored before.
+        Expects ``scores`` as a list of two tuples of (score, movie_id)
+        """
+        self._similarities[int(movie)] = dict((int(movie_id), score)
+                                              for score, movie_id in scores)
+
+    def get_movies_similar_to(self, movie_id):
+        """
+        Return the set of movies whose saved similarity scores include the
+        given movie.
+        """
+        return set(movie for movie, similarities in self._similarities.items()
+                   if int(movie_id) in similarities)
+
+    def take_dirty_movies(self):
+        """
+        Return the set of movies rated since the last call, and clear it.
+        """
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def mark_dirty_movies(self, movie_ids):
+        """
+        Add movies to the set returned by ``take_dirty_movies``.
+        """
+        self._dirty.update(int(movie_id) for movie_id in movie_ids)
+
+    def get_similarity_scores(self, movie_ids):
+        """
+        Retrieve the saved similarity scores for each of the given movies.
+        Returns a dict keyed by movie id, of lists of (score, movie_id) two
+        tuples, highest score first.
+        """
+        scores = {}
+        for movie_id in movie_ids:
+            similarities = self._similarities.get(int(movie_id), {})
+            scores[int(movie_id)] = sorted(
+                [(score, other) for other, score in similarities.items()],
+                reverse=True)
+        return scores
+
+    def get_unrated_movies_for(self, reviewer_id):
+        """
+        Return a set of movie ids that the given reviewer has not yet rated.
+
+        If there is no record of the given reviewer_id, returns all movies.
+        """
+        cols, _ = self._reviewer_row(reviewer_id)
+        return self.get_movies().difference(self._movie_ids[cols].tolist())
+
+    def get_reviewers(self):
+        """
+        Return a set of all reviewers.
+        """
+        return set(self._reviewer_index)
+
+    def get_reviewers_for_movie(self, movie_id):
+        """
+        Return a set of all reviewers who have rated the given movie.
+        """
+        rows, _ = self._movie_column(movie_id)
+        return set(self._reviewer_ids[rows].tolist())
+
+    def get_reviewers_for_movies(self, movie_ids):
+        """
+        Return the set of reviewers of each of the given movies, as a dict
+        keyed by movie id.
+        """
+        return dict((int(movie_id), self.get_reviewers_for_movie(movie_id))
+                    for movie_id in movie_ids)
+
+    def get_reviewer_rating_for_movie(self, reviewer_id, movie_id):
+        """
+        Retrieve the reviewer's rating for the given movie.
+        """
+        col = self._movie_index.get(int(movie_id))
+        if col is None:
+            return None
+        cols, ratings = self._reviewer_row(reviewer_id)
+        position = np.searchsorted(cols, col)
+        if position < len(cols) and cols[position] == col:
+            return float(ratings[position])
+        return None
+
+    def get_ratings_for_reviewer(self, reviewer_id):
+        """
+        Return every rating made by the given reviewer, as a dict keyed by
+        movie id.
+        """
+        cols, values = self._reviewer_row(reviewer_id)
+        return dict(zip(self._movie_ids[cols].tolist(), values.tolist()))
+
+    def get_ratings_for_reviewers(self, reviewer_ids):
+        """
+        Return every rating made by the given reviewers, as a dict of dicts
+        keyed by reviewer id and then movie id.
+        """
+        return dict((int(reviewer_id), self.get_ratings_for_reviewer(reviewer_id))
+                    for reviewer_id in reviewer_ids)
+
+    def get_ratings_matrix(self):
+        """
+        Returns a tuple of (matrix, reviewer_ids, movie_ids), where matrix is
+        the sparse (reviewers x movies) rating matrix and the id arrays give
+        the reviewer for each row and the movie for each column.
+        """
+        self._compact()
+        return self._by_reviewer, self._reviewer_ids, self._movie_ids
+
+    def save_lsh_signatures(self, signatures):
+        """
+        Store reviewers' locality-sensitive hash signatures, given as a dict
+        keyed by reviewer id of lists of bucket numbers, one per table.
+        """
+        for reviewer_id, signature in signatures.items():
+            for table, bucket in enumerate(self._lsh_signatures.get(reviewer_id, [])):
+                self._lsh_buckets[(table, bucket)].discard(reviewer_id)
+            for table, bucket in enumerate(signature):
+                self._lsh_buckets.setdefault((table, bucket), set()).add(reviewer_id)
+            self._lsh_signatures[reviewer_id] = list(signature)
+
+    def get_lsh_candidates(self, signature):
+        """
+        Return the set of reviewers sharing any of the given signature's
+        buckets.
+        """
+        candidates = set()
+        for table, bucket in enumerate(signature):
+            candidates.update(self._lsh_buckets.get((table, bucket), ()))
+        return candidates
+
+    def clear_lsh_signatures(self):
+        """
+        Remove all stored locality-sensitive hash signatures.
+        """
+        self._lsh_signatures = {}
+        self._lsh_buckets = {}
+
+    def _common_ratings(self, indices_1, ratings_1, indices_2, ratings_2):
+        common = np.intersect1d(indices_1, indices_2, assume_unique=True)
+        values_1 = ratings_1[np.searchsorted(indices_1, common)]
+        values_2 = ratings_2[np.searchsorted(indices_2, common)]
+        return list(zip(values_1.tolist(), values_2.tolist()))
+
+    def get_common_ratings_for_reviewers(self, reviewer_id_1, reviewer_id_2):
+        """
+        Returns a list of ratings for all movies that both reviewer_id_1 and
+        reviewer_id_2 have rated, as tuples.
+        """
+        return self._common_ratings(*(self._reviewer_row(reviewer_id_1) +
+                                      self._reviewer_row(reviewer_id_2)))
+
+    def get_common_ratings_for_movies(self, movie_1, movie_2):
+        """
+        Returns a list of ratings for all reviewers that have reviewed both
+        movie_1 and movie_2, as tuples
+        """
+        return self._common_ratings(*(self._movie_column(movie_1) +
+                                      self._movie_column(movie_2)))
+
+    def get_similarity_for_reviewers(self, reviewer_id_1, reviewer_id_2,
+                                     sim_function=sim_pearson):
+        """
+        Returns the similarity score for two reviewers.
+        """
+        return sim_function(self.get_common_ratings_for_reviewers(
+            reviewer_id_1, reviewer_id_2))
+
+    def get_similarity_for_movies(self, movie_1, movie_2,
+                                  sim_function=sim_pearson):
+        """
+        Returns the similarity score for two movies.
+        """
+        return sim_function(self.get_common_ratings_for_movies(movie_1,
+                                                               movie_2))
@@ -0,0 +1,283 @@
+"""
+Model-based recommendations from a matrix factorization of the ratings.
+"""
+import os
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+
+class FactorModel(object):
+    """
+    Approximates each rating as the global mean rating plus the dot product
+    of a reviewer's and a movie's latent factors. Factors are trained with
+    alternating least squares: each pass solves every reviewer's factors
+    with the movie factors held fixed, then the reverse.
+
+    Once trained, every movie is scored for a reviewer with one
+    matrix-vector product.
+    """
+
+    def __init__(self, num_factors=20, regularization=0.1, iterations=10,
+                 seed=0):
+        self.num_factors = num_factors
+        self.regularization = regularization
+        self.iterations = iterations
+        self.seed = seed
+        self.mean = 0.0
+        self.reviewer_ids = np.zeros(0, dtype=np.int64)
+        self.movie_ids = np.zeros(0, dtype=np.int64)
+        self.reviewer_factors = np.zeros((0, num_factors))
+        self.movie_factors = np.zeros((0, num_factors))
+        self._reviewer_index = {}
+        self._movie_index = {}
+
+    @classmethod
+    def train(cls, backend, **kwargs):
+        """
+        Train a model on every rating held by a backend.
+        """
+        model = cls(**kwargs)
+        model.fit(*backend.get_ratings_matrix())
+        return model
+
+    def _index_ids(self):
+        self._reviewer_index = dict((int(reviewer_id), row) for row, reviewer_id
+                                    in enumerate(self.reviewer_ids))
+        self._movie_index = dict((int(movie_id), row) for row, movie_id
+                                 in enumerate(self.movie_ids))
+
+    def _solve(self, matrix, fixed):
+        """
+        Solve the regularized least-squares factors of each row of a sparse
+        rating matrix, holding the factors of its columns fixed.
+        """
+        num_rows = matrix.shape[0]
+        lhs = np.zeros((num_rows, self.num_factors, self.num_factors))
+        rhs = np.zeros((num_rows, self.num_factors))
+        for row in range(num_rows):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            factors = fixed[matrix.indices[start:end]]
+            lhs[row] = factors.T.dot(factors)
+            rhs[row] = factors.T.dot(matrix.data[start:end] - self.mean)
+        # regularization grows with the number of ratings, as in weighted-
+        # lambda ALS, and keeps rows without ratings solvable
+        counts = np.maximum(np.diff(matrix.indptr), 1)
+        lhs += (self.regularization * counts)[:, None, None] * np.eye(self.num_factors)
+        return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+    def fit(self, matrix, reviewer_ids, movie_ids):
+        """
+        Train on a sparse (reviewers x movies) rating matrix, with the id of
+        the reviewer for each row and of the movie for each column.
+        """
+        by_reviewer = sparse.csr_matrix(matrix, dtype=np.float64)
+        by_reviewer.sort_indices()
+        by_movie = by_reviewer.T.tocsr()
+        by_movie.sort_indices()
+
+        self.reviewer_ids = np.asarray(reviewer_ids, dtype=np.int64)
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self._index_ids()
+        self.mean = by_reviewer.data.mean() if by_reviewer.nnz else 0.0
+
+        state = np.random.RandomState(self.seed)
+        self.reviewer_factors = state.normal(
+            scale=0.1, size=(len(self.reviewer_ids), self.num_factors))
+        self.movie_factors = state.normal(
+            scale=0.1, size=(len(self.movie_ids), self.num_factors))
+        for _ in range(self.iterations):
+            self.reviewer_factors = self._solve(by_reviewer, self.movie_factors)
+            self.movie_factors = self._solve(by_movie, self.reviewer_factors)
+        return self
+
+    def knows_reviewer(self, reviewer_id):
+        """
+        Whether the model has factors for the given reviewer.
+        """
+        return int(reviewer_id) in self._reviewer_index
+
+    def fold_in(self, reviewer_id, ratings):
+        """
+        Solve the factors of a new reviewer, or re-solve those of a known
+        one, from their ratings, given as a dict keyed by movie id. Movie
+        factors are held fixed, so this is a single small least-squares
+        solve, and the reviewer can be recommended movies straight away.
+        Ratings of movies the model doesn't know are ignored.
+        """
+        known = [(self._movie_index[int(movie_id)], rating)
+                 for movie_id, rating in ratings.items()
+                 if int(movie_id) in self._movie_index]
+        rows = np.array([row for row, _ in known], dtype=np.int64)
+        values = np.array([rating for _, rating in known], dtype=np.float64)
+        factors = self.movie_factors[rows]
+        lhs = factors.T.dot(factors) + (self.regularization * max(len(rows), 1) *
+                                        np.eye(self.num_factors))
+        vector = np.linalg.solve(lhs, factors.T.dot(values - self.mean))
+
+        row = self._reviewer_index.get(int(reviewer_id))
+        if row is None:
+            self._reviewer_index[int(reviewer_id)] = len(self.reviewer_ids)
+            self.reviewer_ids = np.append(self.reviewer_ids, int(reviewer_id))
+            self.reviewer_factors = np.vstack([self.reviewer_factors, vector])
+        else:
+            self.reviewer_factors[row] = vector
+        return vector
+
+    def _row_for(self, ids_attr, factors_attr, index, item_id):
+        """
+        Return the factor row of a reviewer or movie, adding one with small
+        random factors if the model hasn't seen it.
+        """
+        row = index.get(int(item_id))
+        if row is None:
+            row = index[int(item_id)] = len(getattr(self, ids_attr))
+            setattr(self, ids_attr, np.append(getattr(self, ids_attr), int(item_id)))
+            state = np.random.RandomState(self.seed + row)
+            setattr(self, factors_attr, np.vstack([
+                getattr(self, factors_attr),
+                state.normal(scale=0.1, size=self.num_factors)]))
+        return row
+
+    def partial_fit(self, reviewer_id, movie_id, rating, learning_rate=0.01,
+                    steps=1):
+        """
+        Update the model for a single new rating with a few stochastic
+        gradient descent steps on the reviewer's and the movie's factors.
+        Reviewers and movies the model hasn't seen are added to it.
+        """
+        reviewer = self._row_for('reviewer_ids', 'reviewer_factors',
+                                 self._reviewer_index, reviewer_id)
+        movie = self._row_for('movie_ids', 'movie_factors',
+                              self._movie_index, movie_id)
+        for _ in range(steps):
+            reviewer_factors = self.reviewer_factors[reviewer]
+            movie_factors = self.movie_factors[movie]
+            error = rating - self.mean - reviewer_factors.dot(movie_factors)
+            self.reviewer_factors[reviewer] = reviewer_factors + learning_rate * (
+                error * movie_factors - self.regularization * reviewer_factors)
+            self.movie_factors[movie] = movie_factors + learning_rate * (
+                error * reviewer_factors - self.regularization * movie_factors)
+        return self
+
+    def predict(self, reviewer_id, movie_id):
+        """
+        Predict the reviewer's rating of a movie.
+        """
+        reviewer = self.reviewer_factors[self._reviewer_index[int(reviewer_id)]]
+        movie = self.movie_factors[self._movie_index[int(movie_id)]]
+        return self.mean + reviewer.dot(movie)
+
+    def error(self, matrix, reviewer_ids, movie_ids):
+        """
+        Root mean squared error of the model's predictions for the ratings in
+        a sparse rating matrix, skipping reviewers or movies it doesn't know.
+        """
+        ratings = sparse.coo_matrix(matrix)
+        errors = []
+        for row, col, rating in zip(ratings.row, ratings.col, ratings.data):
+            reviewer_id, movie_id = int(reviewer_ids[row]), int(movie_ids[col])
+            if reviewer_id in self._reviewer_index and movie_id in self._movie_index:
+                errors.append(self.predict(reviewer_id, movie_id) - rating)
+        return float(np.sqrt(np.mean(np.square(errors)))) if errors else 0.0
+
+    def recommend(self, reviewer_id, num=20, candidates=None):
+        """
+        Returns the top num movies for the reviewer, as (score, movie_id)
+        tuples, highest first, optionally restricted to the movie ids in
+        ``candidates``. Returns an empty list for unknown reviewers.
+        """
+        row = self._reviewer_index.get(int(reviewer_id))
+        if row is None:
+            return []
+        scores = self.movie_factors.dot(self.reviewer_factors[row]) + self.mean
+        if candidates is not None:
+            allowed = np.array([int(movie_id) in candidates
+                                for movie_id in self.movie_ids], dtype=bool)
+            scores = np.where(allowed, scores, -np.inf)
+        num = min(num, int(np.isfinite(scores).sum()))
+        if num <= 0:
+            return []
+        top = np.argpartition(-scores, num - 1)[:num]
+        top = top[np.lexsort((self.movie_ids[top], scores[top]))[::-1]]
+        return [(float(scores[i]), int(self.movie_ids[i])) for i in top]
+
+    def save(self, path):
+        """
+        Persist the trained factors to a NumPy ``.npz`` file.
+        """
+        np.savez(path, mean=self.mean, reviewer_ids=self.reviewer_ids,
+                 movie_ids=self.movie_ids,
+                 reviewer_factors=self.reviewer_factors,
+                 movie_factors=self.movie_factors,
+                 params=np.array([self.num_factors, self.regularization,
+                                  self.iterations, self.seed]))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load factors persisted with ``save``.
+        """
+        data = np.load(path)
+        num_factors, regularization, iterations, seed = data['params'].tolist()
+        model = cls(num_factors=int(num_factors), regularization=regularization,
+                    iterations=int(iterations), seed=int(seed))
+        model.mean = float(data['mean'])
+        model.reviewer_ids = data['reviewer_ids']
+        model.movie_ids = data['movie_ids']
+        model.reviewer_factors = data['reviewer_factors']
+        model.movie_factors = data['movie_factors']
+        model._index_ids()
+        return model
+
+
+class OnlineUpdater(object):
+    """
+    Keeps a ``FactorModel`` fresh between full retrains by applying
+    ``partial_fit`` to each new rating. Register it with a backend's
+    ``add_rating_listener``, or feed it a stream of ratings with
+    ``consume``.
+
+    If ``path`` is given, the model is saved there every ``snapshot_every``
+    updates, so a crash loses at most that many.
+    """
+
+    def __init__(self, model, path=None, snapshot_every=1000,
+                 learning_rate=0.01, steps=1):
+        self.model = model
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.learning_rate = learning_rate
+        self.steps = steps
+        self.updates = 0
+
+    def __call__(self, reviewer_id, movie_id, rating):
+        self.model.partial_fit(reviewer_id, movie_id, rating,
+                               learning_rate=self.learning_rate,
+                               steps=self.steps)
+        self.updates += 1
+        if self.path and self.updates % self.snapshot_every == 0:
+            self.snapshot()
+
+    def consume(self, ratings):
+        """
+        Apply every (reviewer_id, movie_id, rating) tuple from an iterable.
+        """
+        for reviewer_id, movie_id, rating in ratings:
+            self(reviewer_id, movie_id, rating)
+
+    def snapshot(self):
+        """
+        Save the model to ``path``. It's written to a temporary file first
+        and renamed into place, so a crash mid-write keeps the last snapshot.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                self.model.save(f)
+            os.rename(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
@@ -0,0 +1,118 @@
+"""
+Locality-sensitive hashing of reviewer rating vectors, for finding candidate
+neighbors without comparing a reviewer with every other reviewer.
+"""
+import numpy as np
+from scipy import sparse
+
+
+def center_ratings(matrix):
+    """
+    Subtract each reviewer's mean rating from their ratings in a sparse
+    (reviewers x movies) matrix. Unrated movies stay zero.
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    counts = np.diff(matrix.indptr)
+    means = np.asarray(matrix.sum(axis=1)).ravel() / np.maximum(counts, 1)
+    centered = matrix.copy()
+    centered.data -= np.repeat(means, counts)
+    return centered
+
+
+class ReviewerLSHIndex(object):
+    """
+    Sign random projection index over reviewers' mean-centered ratings, with
+    unrated movies counted as zero. Two reviewers share a bucket with a
+    probability that rises with the cosine of their centered rating vectors,
+    so that cosine is what the index finds neighbors by. It only loosely
+    tracks ``sim_pearson``, which is taken over co-rated movies alone.
+    Reviewers who gave every movie the same rating have no direction, and
+    all hash to the same buckets.
+
+    Each of ``num_tables`` tables hashes a reviewer to ``num_bits`` bits, and
+    a reviewer's candidates are everyone sharing a bucket in any table. More
+    tables raise recall; more bits make buckets smaller, and queries faster.
+    Buckets are stored in the backend, alongside the ratings. They don't
+    follow new ratings by themselves: call ``update``, or ``watch`` the
+    backend ratings are added through.
+    """
+
+    def __init__(self, backend, num_tables=8, num_bits=10, seed=0):
+        self.backend = backend
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.seed = seed
+        self._planes = {}  # movie id -> projection of that movie on each plane
+
+    def _planes_for(self, movie_ids):
+        """
+        Return the (movies x planes) projection matrix for the given movies.
+        Each movie's row is derived from its id, so it is the same in every
+        process and for movies added after the index was built.
+        """
+        num_planes = self.num_tables * self.num_bits
+        rows = []
+        for movie_id in movie_ids:
+            movie_id = int(movie_id)
+            if movie_id not in self._planes:
+                state = np.random.RandomState((self.seed * 1000003 + movie_id) %
+                                              (2 ** 32))
+                self._planes[movie_id] = state.randn(num_planes)
+            rows.append(self._planes[movie_id])
+        return np.array(rows).reshape(len(rows), num_planes)
+
+    def _signatures(self, matrix, movie_ids):
+        """
+        Hash each row of a sparse (reviewers x movies) rating matrix, returning
+        a (reviewers x tables) array of bucket numbers.
+        """
+        bits = center_ratings(matrix).dot(self._planes_for(movie_ids)) >= 0
+        bits = bits.reshape(-1, self.num_tables, self.num_bits)
+        return bits.dot(2 ** np.arange(self.num_bits))
+
+    def _signature_for(self, ratings):
+        """
+        Hash a single reviewer, given their ratings as a dict keyed by movie id.
+        """
+        movie_ids = list(ratings)
+        matrix = sparse.csr_matrix(np.array([[ratings[movie_id]
+                                              for movie_id in movie_ids]]))
+        return [int(bucket) for bucket in self._signatures(matrix, movie_ids)[0]]
+
+    def build(self):
+        """
+        Hash every reviewer in the backend, replacing any existing index.
+        """
+        matrix, reviewer_ids, movie_ids = self.backend.get_ratings_matrix()
+        signatures = self._signatures(matrix, movie_ids)
+        self.backend.clear_lsh_signatures()
+        self.backend.save_lsh_signatures(dict(
+            (int(reviewer_id), [int(bucket) for bucket in signature])
+            for reviewer_id, signature in zip(reviewer_ids, signatures)))
+
+    def update(self, reviewer_ids):
+        """
+        Re-hash the given reviewers, after their ratings have changed.
+        """
+        ratings = self.backend.get_ratings_for_reviewers(reviewer_ids)
+        self.backend.save_lsh_signatures(dict(
+            (reviewer_id, self._signature_for(reviewer_ratings))
+            for reviewer_id, reviewer_ratings in ratings.items()))
+
+    def watch(self, backend=None):
+        """
+        Re-hash a reviewer whenever a rating is added for them through the
+        given backend, by default the index's own. Each rating then costs
+        one more read of that reviewer's ratings.
+        """
+        (backend or self.backend).add_rating_listener(
+            lambda reviewer_id, movie_id, rating: self.update([reviewer_id]))
+
+    def candidates(self, reviewer_id):
+        """
+        Return the set of reviewers sharing a bucket with the given reviewer,
+        in any table.
+        """
+        signature = self._signature_for(
+            self.backend.get_ratings_for_reviewer(reviewer_id))
+        return self.backend.get_lsh_candidates(signature)
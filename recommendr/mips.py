@@ -0,0 +1,130 @@
+"""
+Approximate maximum inner product search over a factor model's movie
+factors, for retrieving a reviewer's top scoring movies without scoring
+every movie.
+"""
+import numpy as np
+
+
+class FactorIndex(object):
+    """
+    Inverted file index over the movie factors of a ``FactorModel``. Movies
+    are clustered with k-means, and a query scores only the movies in the
+    ``probes`` clusters whose centroids look most promising. More probes
+    raise recall at the cost of scoring more movies.
+
+    Inner products aren't distances, so each movie's factors get one extra
+    coordinate that brings every vector to the same norm. For those vectors,
+    and a query with a zero in that coordinate, the largest inner product
+    is the nearest neighbor, which is what k-means clusters are good at.
+
+    The index is a snapshot of the model's movie factors: call ``build``
+    again after retraining, or once online updates have added movies.
+    """
+
+    def __init__(self, model, num_clusters=None, probes=4, iterations=10,
+                 seed=0):
+        self.model = model
+        self.num_clusters = num_clusters
+        self.probes = probes
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = np.zeros((0, model.num_factors + 1))
+        self.movie_ids = np.zeros(0, dtype=np.int64)
+        self.movie_factors = np.zeros((0, model.num_factors))
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def _augment(self, factors):
+        norms = (factors ** 2).sum(axis=1)
+        extra = np.sqrt(np.maximum(norms.max() - norms, 0)) if len(norms) else norms
+        return np.hstack([factors, extra[:, None]])
+
+    def _kmeans(self, points, num_clusters):
+        """
+        Lloyd's k-means, returning the centroids and each point's cluster.
+        """
+        state = np.random.RandomState(self.seed)
+        centroids = points[state.choice(len(points), num_clusters, replace=False)]
+        for _ in range(self.iterations):
+            distances = ((centroids ** 2).sum(axis=1)[None, :] -
+                         2 * points.dot(centroids.T))
+            labels = distances.argmin(axis=1)
+            for cluster in range(num_clusters):
+                members = points[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+        distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * points.dot(centroids.T)
+        return centroids, distances.argmin(axis=1)
+
+    def build(self):
+        """
+        Cluster the model's movie factors. Returns the index.
+        """
+        num_movies = len(self.model.movie_ids)
+        if not num_movies:
+            return self
+        num_clusters = self.num_clusters or int(np.ceil(np.sqrt(num_movies)))
+        num_clusters = min(num_clusters, num_movies)
+        centroids, labels = self._kmeans(self._augment(self.model.movie_factors),
+                                         num_clusters)
+        # store movies grouped by cluster, with cluster c at
+        # offsets[c]:offsets[c + 1], like the rows of a CSR matrix
+        order = np.argsort(labels, kind='mergesort')
+        self.centroids = centroids
+        self.movie_ids = self.model.movie_ids[order]
+        self.movie_factors = self.model.movie_factors[order]
+        self.offsets = np.concatenate([
+            [0], np.cumsum(np.bincount(labels, minlength=num_clusters))])
+        return self
+
+    def search(self, vector, num, probes=None):
+        """
+        Return up to ``num`` (score, movie_id) tuples with the largest
+        predicted ratings for a reviewer's factor vector, best first,
+        from the movies in the most promising clusters.
+        """
+        probes = min(probes or self.probes, len(self.centroids))
+        if num <= 0 or not probes:
+            return []
+        # nearest centroids to the augmented query (vector, 0)
+        closeness = (2 * self.centroids[:, :-1].dot(vector) -
+                     (self.centroids ** 2).sum(axis=1))
+        clusters = np.argpartition(-closeness, probes - 1)[:probes]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1])
+                               for c in clusters])
+        scores = self.movie_factors[rows].dot(vector) + self.model.mean
+        num = min(num, len(rows))
+        if not num:
+            return []
+        top = np.argpartition(-scores, num - 1)[:num]
+        top = top[np.lexsort((self.movie_ids[rows[top]], scores[top]))[::-1]]
+        return [(float(scores[i]), int(self.movie_ids[rows[i]])) for i in top]
+
+    def recommend(self, reviewer_id, num=20, candidates=None, probes=None):
+        """
+        Like ``FactorModel.recommend``, but from the index. Movies not in
+        ``candidates`` are dropped after retrieval, fetching more, and then
+        probing more clusters, until there are ``num`` left or every
+        cluster has been searched.
+        """
+        row = self.model._reviewer_index.get(int(reviewer_id))
+        if row is None:
+            return []
+        vector = self.model.reviewer_factors[row]
+        probes = probes or self.probes
+        fetch = num
+        while True:
+            found = self.search(vector, fetch, probes)
+            kept = found
+            if candidates is not None:
+                kept = [(score, movie_id) for score, movie_id in found
+                        if movie_id in candidates]
+            if len(kept) >= num:
+                return kept[:num]
+            if len(found) < fetch:
+                # every movie in the probed clusters has been scored
+                if probes >= len(self.centroids):
+                    return kept
+                probes *= 2
+            else:
+                fetch *= 2
@@ -1,9 +1,15 @@
 """
 Similarity functions. All functions return a score from 0 to 1, where 1
 means most similar and 0 means least similar.
+
+Each function has an array-based counterpart, which compares a rating vector
+with an aligned vector or with every row of a matrix at once.
 """
 from math import sqrt
 
+import numpy as np
+from scipy import sparse
+
 
 def sim_distance(ratings):
     """
@@ -41,3 +47,170 @@ def sim_pearson(ratings):
     
     return numerator / denominator
 
+
+def sim_cosine(ratings):
+    """
+    Given a list of ratings as two-tuples, returns the cosine similarity score
+    """
+    sum_of_products = sum([rating_1 * rating_2
+                           for rating_1, rating_2 in ratings])
+    denominator = sqrt(sum([rating_1**2 for rating_1, _ in ratings]) *
+                       sum([rating_2**2 for _, rating_2 in ratings]))
+    if denominator == 0:
+        return 0
+    return sum_of_products / denominator
+
+
+def rating_sums(ratings, others):
+    """
+    Returns the sums needed by the similarity functions, as a tuple of
+    (count, sum_1, sum_2, sum_1_sq, sum_2_sq, sum_of_products), taken over
+    the positions rated in both ``ratings`` and ``others``.
+
+    ``ratings`` is a rating vector. ``others`` is either a vector of the same
+    length, or a dense or sparse matrix with one such vector per row, in which
+    case every sum is an array with one entry per row. A rating of zero means
+    "not rated".
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    rated = (ratings != 0).astype(np.float64)
+    if sparse.issparse(others):
+        others = sparse.csr_matrix(others, dtype=np.float64)
+        others_rated = others.copy()
+        others_rated.data = (others_rated.data != 0).astype(np.float64)
+        others_sq = others.multiply(others)
+    else:
+        others = np.asarray(others, dtype=np.float64)
+        others_rated = (others != 0).astype(np.float64)
+        others_sq = others ** 2
+    return (np.asarray(others_rated.dot(rated)),
+            np.asarray(others_rated.dot(ratings)),
+            np.asarray(others.dot(rated)),
+            np.asarray(others_rated.dot(ratings ** 2)),
+            np.asarray(others_sq.dot(rated)),
+            np.asarray(others.dot(ratings)))
+
+
+def pairwise_rating_sums(matrix, columns):
+    """
+    Returns the output of ``rating_sums`` for every pair of columns of a
+    sparse rating matrix, against the given block of columns. Every sum is
+    a dense (all columns x block columns) array, where the first side of
+    each pair is the block column, as with the ``ratings`` argument of
+    ``rating_sums``. Computed with six sparse matrix products.
+    """
+    matrix = sparse.csc_matrix(matrix, dtype=np.float64)
+    rated = matrix.copy()
+    rated.data = (rated.data != 0).astype(np.float64)
+    squared = matrix.multiply(matrix).tocsc()
+    block, block_rated, block_squared = (matrix[:, columns],
+                                         rated[:, columns],
+                                         squared[:, columns])
+    return tuple(product.toarray() for product in (
+        rated.T.dot(block_rated),
+        rated.T.dot(block),
+        matrix.T.dot(block_rated),
+        rated.T.dot(block_squared),
+        squared.T.dot(block_rated),
+        matrix.T.dot(block)))
+
+
+def sim_distance_from_sums(count, sum_1, sum_2, sum_1_sq, sum_2_sq,
+                           sum_of_products):
+    """
+    Returns the Euclidean distance score from the output of ``rating_sums``.
+    """
+    sum_of_squares = np.maximum(sum_1_sq + sum_2_sq - 2 * sum_of_products, 0)
+    return 1 / (1 + np.sqrt(sum_of_squares))
+
+
+def sim_pearson_from_sums(count, sum_1, sum_2, sum_1_sq, sum_2_sq,
+                          sum_of_products):
+    """
+    Returns the Pearson Correlation score from the output of ``rating_sums``.
+    Scores are zero wherever there are no common ratings, or where either
+    side has no variance.
+    """
+    count = np.asarray(count, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        numerator = sum_of_products - (sum_1 * sum_2 / count)
+        denominator = np.sqrt(np.maximum(
+            (sum_1_sq - sum_1 ** 2 / count) * (sum_2_sq - sum_2 ** 2 / count),
+            0))
+        scores = numerator / denominator
+    return np.where((count > 0) & (denominator > 0), scores, 0.0)
+
+
+def sim_cosine_from_sums(count, sum_1, sum_2, sum_1_sq, sum_2_sq,
+                        sum_of_products):
+    """
+    Returns the cosine similarity score from the output of ``rating_sums``.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = np.sqrt(sum_1_sq * sum_2_sq)
+        scores = sum_of_products / denominator
+    return np.where(denominator > 0, scores, 0.0)
+
+
+def sim_distance_array(ratings, others):
+    """
+    Given a rating vector and an aligned vector, or a matrix with one such
+    vector per row, returns the Euclidean distance score(s).
+    """
+    return sim_distance_from_sums(*rating_sums(ratings, others))
+
+
+def sim_pearson_array(ratings, others):
+    """
+    Given a rating vector and an aligned vector, or a matrix with one such
+    vector per row, returns the Pearson Correlation score(s).
+    """
+    return sim_pearson_from_sums(*rating_sums(ratings, others))
+
+
+def sim_cosine_array(ratings, others):
+    """
+    Given a rating vector and an aligned vector, or a matrix with one such
+    vector per row, returns the cosine similarity score(s).
+    """
+    return sim_cosine_from_sums(*rating_sums(ratings, others))
+
+
+# Array-based and sum-based counterparts of the similarity functions.
+ARRAY_FUNCTIONS = {
+    sim_cosine: sim_cosine_array,
+    sim_distance: sim_distance_array,
+    sim_pearson: sim_pearson_array,
+}
+
+SUMS_FUNCTIONS = {
+    sim_cosine: sim_cosine_from_sums,
+    sim_distance: sim_distance_from_sums,
+    sim_pearson: sim_pearson_from_sums,
+}
+
+
+def _vectorized(functions, similarity):
+    try:
+        return functions[similarity]
+    except KeyError:
+        raise ValueError(
+            "{0} has no vectorized counterpart; use one of {1}".format(
+                getattr(similarity, '__name__', similarity),
+                ", ".join(sorted(function.__name__ for function in functions))))
+
+
+def array_function(similarity):
+    """
+    Returns the array-based counterpart of a similarity function, raising
+    ValueError if it has none.
+    """
+    return _vectorized(ARRAY_FUNCTIONS, similarity)
+
+
+def sums_function(similarity):
+    """
+    Returns the counterpart of a similarity function that works from the
+    output of ``rating_sums``, raising ValueError if it has none.
+    """
+    return _vectorized(SUMS_FUNCTIONS, similarity)
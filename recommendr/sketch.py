@@ -0,0 +1,84 @@
+"""
+MinHash sketches of movies' reviewer sets, for cheaply estimating how many
+reviewers two movies have in common.
+"""
+import numpy as np
+
+
+# Mersenne prime modulus for the universal hash functions
+PRIME = (1 << 31) - 1
+
+
+class MinHashSketches(object):
+    """
+    A MinHash signature of ``num_hashes`` values for each movie's set of
+    reviewers. The fraction of matching values between two signatures
+    estimates the Jaccard similarity of the two sets, and with the set sizes,
+    the number of reviewers they share. More hashes give better estimates.
+    """
+
+    def __init__(self, num_hashes=64, seed=0):
+        state = np.random.RandomState(seed)
+        self.num_hashes = num_hashes
+        self._a = state.randint(1, PRIME, size=num_hashes).astype(np.int64)
+        self._b = state.randint(0, PRIME, size=num_hashes).astype(np.int64)
+        self._index = {}  # movie id -> row
+        self._signatures = []
+        self._sizes = []
+        self._stacked = None  # (signatures, sizes) arrays, built on demand
+
+    @classmethod
+    def from_backend(cls, backend, movie_ids, num_hashes=64, seed=0):
+        """
+        Sketch the reviewers of each of the given movies.
+        """
+        sketches = cls(num_hashes=num_hashes, seed=seed)
+        for movie_id, reviewer_ids in backend.get_reviewers_for_movies(movie_ids).items():
+            sketches.add(movie_id, reviewer_ids)
+        return sketches
+
+    def add(self, movie_id, reviewer_ids):
+        """
+        Sketch a movie's set of reviewers.
+        """
+        self._stacked = None
+        reviewer_ids = np.array(sorted(reviewer_ids), dtype=np.int64)
+        signature = np.full(self.num_hashes, PRIME, dtype=np.int64)
+        if len(reviewer_ids):
+            hashes = (np.outer(reviewer_ids, self._a) + self._b) % PRIME
+            signature = hashes.min(axis=0)
+        if int(movie_id) in self._index:
+            row = self._index[int(movie_id)]
+            self._signatures[row] = signature
+            self._sizes[row] = len(reviewer_ids)
+        else:
+            self._index[int(movie_id)] = len(self._signatures)
+            self._signatures.append(signature)
+            self._sizes.append(len(reviewer_ids))
+
+    def estimate_overlaps(self, movie_id, others):
+        """
+        Return an array with the estimated number of reviewers the movie has
+        in common with each of the movies in ``others``.
+        """
+        if self._stacked is None:
+            self._stacked = (np.array(self._signatures).reshape(-1, self.num_hashes),
+                             np.array(self._sizes, dtype=np.float64))
+        signatures, sizes = self._stacked
+        row = self._index[int(movie_id)]
+        rows = np.array([self._index[int(other)] for other in others],
+                        dtype=np.int64)
+        jaccard = (signatures[rows] == signatures[row]).mean(axis=1)
+        return jaccard * (sizes[row] + sizes[rows]) / (1 + jaccard)
+
+    def candidates(self, movie_id, others, min_overlap):
+        """
+        Return the movies in ``others`` estimated to share at least
+        ``min_overlap`` reviewers with the given movie.
+        """
+        others = list(others)
+        if not others:
+            return []
+        overlaps = self.estimate_overlaps(movie_id, others)
+        return [other for other, overlap in zip(others, overlaps)
+                if overlap >= min_overlap]
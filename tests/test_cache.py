@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import fakeredis
+
+import recommendr
+from recommendr.cache import LRUCache, RedisCache
+from recommendr.db import MemoryBackend, RedisBackend
+
+
+class TestLRUCache:
+
+    def test_get_and_set(self):
+        cache = LRUCache(max_size=2)
+        cache.set(1, 'a', [(5, 1)])
+        cache.set(2, 'a', [(4, 2)])
+        assert cache.get(1, 'a') == [(5, 1)]
+        cache.set(3, 'a', [(3, 3)])
+        # 2 was the least recently used
+        assert cache.get(2, 'a') is None
+        assert cache.get(1, 'a') == [(5, 1)]
+        assert cache.get(3, 'a') == [(3, 3)]
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=-1)
+        cache.set(1, 'a', [(5, 1)])
+        assert cache.get(1, 'a') is None
+
+    def test_watch(self):
+        backend = MemoryBackend()
+        cache = LRUCache()
+        cache.watch(backend)
+        cache.set(1, 'a', [(5, 1)])
+        cache.set(1, 'b', [(5, 1)])
+        cache.set(2, 'a', [(4, 2)])
+        backend.add_rating(1, 10, 3)
+        assert cache.get(1, 'a') is None
+        assert cache.get(1, 'b') is None
+        assert cache.get(2, 'a') == [(4, 2)]
+
+    def test_set_after_invalidate(self):
+        cache = LRUCache()
+        generation = cache.generation(1)
+        cache.invalidate(1)
+        cache.set(1, 'a', [(5, 1)], generation)
+        assert cache.get(1, 'a') is None
+        cache.set(1, 'a', [(5, 1)], cache.generation(1))
+        assert cache.get(1, 'a') == [(5, 1)]
+
+
+class TestRedisCache:
+
+    def setup_method(self, method):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.redis.flushall()
+        self.cache = RedisCache(self.redis, ttl=60)
+
+    def test_get_and_set(self):
+        assert self.cache.get(1, 'a') is None
+        self.cache.set(1, 'a', [(4.5, 1), (3, 2)])
+        assert self.cache.get(1, 'a') == [(4.5, 1), (3, 2)]
+        assert 0 < self.redis.ttl("uid:1:recommendations") <= 60
+        self.cache.invalidate(1)
+        assert self.cache.get(1, 'a') is None
+
+    def test_add_rating_invalidates(self):
+        backend = RedisBackend(client=self.redis, lua_similarity=False,
+                               invalidate_cache=True)
+        self.cache.set(1, 'a', [(5, 1)])
+        self.cache.set(2, 'a', [(4, 2)])
+        backend.add_rating(1, 10, 3)
+        assert self.cache.get(1, 'a') is None
+        assert self.cache.get(2, 'a') == [(4, 2)]
+
+    def test_add_rating_leaves_cache_by_default(self):
+        backend = RedisBackend(client=self.redis, lua_similarity=False)
+        self.cache.set(1, 'a', [(5, 1)])
+        backend.add_rating(1, 10, 3)
+        assert self.cache.get(1, 'a') == [(5, 1)]
+
+    def test_set_after_add_rating(self):
+        backend = RedisBackend(client=self.redis, lua_similarity=False,
+                               invalidate_cache=True)
+        generation = self.cache.generation(1)
+        backend.add_rating(1, 10, 3)
+        self.cache.set(1, 'a', [(5, 1)], generation)
+        assert self.cache.get(1, 'a') is None
+        generation = self.cache.generation(1)
+        self.cache.invalidate(1)
+        self.cache.set(1, 'a', [(5, 1)], generation)
+        assert self.cache.get(1, 'a') is None
+        self.cache.set(1, 'a', [(5, 1)], self.cache.generation(1))
+        assert self.cache.get(1, 'a') == [(5, 1)]
+
+
+class TestCachedRecommendations:
+
+    def setup_method(self, method):
+        self.original_db = recommendr.db
+        self.original_cache = recommendr.result_cache
+        recommendr.db = self.backend = MemoryBackend()
+        for reviewer_id, movie_id, rating in [(1, 1, 5), (1, 2, 3), (2, 1, 5),
+                                              (2, 2, 3), (2, 3, 4), (2, 4, 2)]:
+            self.backend.add_rating(reviewer_id, movie_id, rating)
+        for movie_id in range(1, 6):
+            self.backend.add_movie(movie_id, "Movie {0}".format(movie_id))
+        recommendr.result_cache = self.cache = LRUCache()
+        self.cache.watch(self.backend)
+
+    def teardown_method(self, method):
+        recommendr.db = self.original_db
+        recommendr.result_cache = self.original_cache
+
+    def test_user_based(self):
+        rankings = recommendr.get_user_based_recommendations(1, num=5)
+        assert rankings == [(4, 3), (2, 4)]
+        self.backend._movies.clear()  # a cache hit doesn't read the backend
+        assert recommendr.get_user_based_recommendations(1, 5) == rankings
+        assert recommendr.get_user_based_recommendations(
+            1, num=5, budget=0) == rankings
+        # a different call misses, and sees the emptied backend
+        assert recommendr.get_user_based_recommendations(1, num=1) == []
+        self.backend.add_rating(1, 5, 1)
+        assert recommendr.get_user_based_recommendations(1, num=5) == []
+
+    def test_incomplete_results_are_not_cached(self):
+        rankings = recommendr.get_user_based_recommendations(1, num=5, budget=0)
+        assert not rankings.complete
+        assert recommendr.get_user_based_recommendations(1, num=5) == \
+            [(4, 3), (2, 4)]
+
+    def test_item_based(self):
+        self.backend.save_similarity_scores(1, [(0.5, 3)])
+        assert recommendr.get_item_based_recommendations(1) == [(5, 3)]
+        self.backend.save_similarity_scores(1, [(0.5, 4)])
+        assert recommendr.get_item_based_recommendations(1) == [(5, 3)]
+        self.backend.add_rating(1, 5, 1)
+        assert recommendr.get_item_based_recommendations(1) == [(5, 4)]
+
+    def test_rating_added_during_computation(self):
+        calls = []
+
+        def similarity(ratings):
+            calls.append(ratings)
+            if not self.backend.get_ratings_for_reviewer(1).get(5):
+                self.backend.add_rating(1, 5, 1)
+            return recommendr.sim_distance(ratings)
+        rankings = recommendr.get_user_based_recommendations(
+            1, num=5, similarity=similarity)
+        assert rankings == [(4, 3), (2, 4)]
+        # computed from the ratings before the one added, so not stored
+        computed = len(calls)
+        recommendr.get_user_based_recommendations(1, num=5, similarity=similarity)
+        assert len(calls) > computed
+        computed = len(calls)
+        recommendr.get_user_based_recommendations(1, num=5, similarity=similarity)
+        assert len(calls) == computed
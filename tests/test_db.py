@@ -1,19 +1,25 @@
+import pickle
+import random
+
 import fakeredis
+import pytest
+import redis
 
-from recommendr.db import RedisBackend
+from recommendr.db import RedisBackend, MemoryBackend
+from recommendr.similarity import sim_pearson, sim_distance
 
 class TestRedisBackend:
 
     @classmethod
     def setup_class(cls):
         r = fakeredis.FakeStrictRedis()
-        backend = RedisBackend(client=r)
+        backend = RedisBackend(client=r, lua_similarity=False, track_dirty=True)
 
         # Start with a clean DB
         backend.clear()
         cls.backend = backend
 
-    def setup(self):
+    def setup_method(self, method):
         self.backend.clear()
 
     def test_add_genre(self):
@@ -63,6 +69,13 @@ class TestRedisBackend:
         reviewers = self.backend.get_reviewers_for_movie(1)
         assert 10 in reviewers
 
+    def test_get_reviewers_for_movies(self):
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating(11, 1, 4)
+        self.backend.add_rating(11, 2, 4)
+        reviewers = self.backend.get_reviewers_for_movies([1, 2, 3])
+        assert reviewers == {1: set([10, 11]), 2: set([11]), 3: set()}
+
     def test_get_reviewer_rating_for_movie(self):
         self.backend.add_movie(1, "Cujo")
         self.backend.add_rating(10, 1, 3)
@@ -101,7 +114,333 @@ class TestRedisBackend:
         assert (3, 5) in ratings
         assert (4, 2) in ratings
 
+    def test_get_ratings_matrix(self):
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating(11, 2, 4)
+        matrix, reviewer_ids, movie_ids = self.backend.get_ratings_matrix()
+        assert matrix.shape == (len(reviewer_ids), len(movie_ids))
+        assert matrix.nnz == 2
+        row = list(reviewer_ids).index(11)
+        col = list(movie_ids).index(2)
+        assert matrix[row, col] == 4
+
+    def test_get_ratings_for_reviewer(self):
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating(10, 2, 5)
+        self.backend.add_rating(11, 2, 4)
+        assert self.backend.get_ratings_for_reviewer(10) == {1: 3, 2: 5}
+        assert self.backend.get_ratings_for_reviewer(12) == {}
+
+    def test_get_similarity_scores(self):
+        self.backend.save_similarity_scores(1, [(0.5, 2), (0.75, 3)])
+        scores = self.backend.get_similarity_scores([1, 2])
+        assert scores[1] == [(0.75, 3), (0.5, 2)]
+        assert scores[2] == []
+
+    def test_save_similarity_scores_replaces(self):
+        self.backend.save_similarity_scores(1, [(0.5, 2), (0.75, 3)])
+        self.backend.save_similarity_scores(1, [(0.25, 3), (0.1, 4)])
+        assert self.backend.get_similarity_scores([1])[1] == [(0.25, 3), (0.1, 4)]
+        assert self.backend.get_movies_similar_to(2) == set()
+        assert self.backend.get_movies_similar_to(4) == set([1])
+
+    def test_take_dirty_movies(self):
+        self.backend.take_dirty_movies()
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating(11, 2, 4)
+        assert self.backend.take_dirty_movies() == set([1, 2])
+        assert self.backend.take_dirty_movies() == set()
+        self.backend.mark_dirty_movies([3, 4])
+        assert self.backend.take_dirty_movies() == set([3, 4])
+
+    def test_track_dirty_off(self):
+        backend = RedisBackend(client=fakeredis.FakeStrictRedis(),
+                               lua_similarity=False)
+        backend.clear()
+        backend.add_rating(10, 1, 3)
+        assert backend.take_dirty_movies() == set()
+
+    def test_add_rating_listener(self):
+        calls = []
+        self.backend.add_rating_listener(lambda *args: calls.append(args))
+        try:
+            self.backend.add_rating(10, 1, 3)
+            self.backend.add_rating(11, 2, 4)
+        finally:
+            del self.backend._rating_listeners[:]
+        assert calls == [(10, 1, 3), (11, 2, 4)]
+
+    def test_get_similarity_for_movies(self):
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating(11, 1, 4)
+        self.backend.add_rating(10, 2, 5)
+        self.backend.add_rating(11, 2, 2)
+        assert self.backend.get_similarity_for_movies(1, 2, sim_pearson) == -1
+        score = self.backend.get_similarity_for_reviewers(10, 11, sim_distance)
+        assert score == sim_distance([(3, 4), (5, 2)])
+
     def test_ignore_duplicate_ratings(self):
         self.backend.add_movie(1, "Cujo")
         self.backend.add_rating(10, 1, 3)
-        
\ No newline at end of file
+        
+
+
+class RoundTripCounter(object):
+    """
+    Wraps a Redis client, counting the commands sent directly and the
+    pipelines executed. Each is one network round trip.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        counter = self
+
+        if name == 'pipeline':
+            def pipeline(*args, **kwargs):
+                pipe = attr(*args, **kwargs)
+                execute = pipe.execute
+
+                def counted_execute(*args, **kwargs):
+                    counter.round_trips += 1
+                    return execute(*args, **kwargs)
+                pipe.execute = counted_execute
+                return pipe
+            return pipeline
+
+        def command(*args, **kwargs):
+            counter.round_trips += 1
+            return attr(*args, **kwargs)
+        return command
+
+
+class TestRedisRoundTrips:
+
+    def setup_method(self, method):
+        self.client = RoundTripCounter(fakeredis.FakeStrictRedis())
+        self.backend = RedisBackend(client=self.client)
+        self.backend.clear()
+        for movie_id in range(1, 11):
+            self.backend.add_rating(10, movie_id, movie_id % 5 + 1)
+            self.backend.add_rating(11, movie_id, (movie_id + 2) % 5 + 1)
+        self.client.round_trips = 0
+
+    def test_common_ratings_for_reviewers_round_trips(self):
+        ratings = self.backend.get_common_ratings_for_reviewers(10, 11)
+        assert len(ratings) == 10
+        assert (1, 3) in ratings
+        assert self.client.round_trips == 1
+
+    def test_common_ratings_for_movies_round_trips(self):
+        ratings = self.backend.get_common_ratings_for_movies(1, 2)
+        assert sorted(ratings) == [(2, 3), (4, 5)]
+        assert self.client.round_trips == 1
+
+    def test_names_for_movies_round_trips(self):
+        for movie_id in range(1, 4):
+            self.backend.add_movie(movie_id, "Movie {0}".format(movie_id))
+        self.client.round_trips = 0
+        names = self.backend.get_names_for_movies([1, 2, 3, 4])
+        assert sorted(names) == [1, 2, 3, 4]
+        assert names[4] is None
+        assert self.client.round_trips == 1
+        self.backend.get_names_for_movies([1, 2, 3], chunk_size=2)
+        assert self.client.round_trips == 3
+
+    def test_common_ratings_leave_no_keys(self):
+        keys = set(self.client.keys())
+        self.backend.get_common_ratings_for_movies(1, 2)
+        assert set(self.client.keys()) == keys
+
+
+class LupaScriptClient(object):
+    """
+    Wraps a fakeredis client, which can't run Lua, to run registered scripts
+    under lupa instead. ``redis.call`` is forwarded to the wrapped client,
+    with replies converted as Redis converts them for Lua: nil replies
+    become false, and scores become strings.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _call(self, lua, command, *args):
+        kwargs = {}
+        if args and str(args[-1]).upper() == 'WITHSCORES':
+            args, kwargs = args[:-1], {'withscores': True}
+        reply = getattr(self.client, command.lower())(*args, **kwargs)
+        if reply is None:
+            return False
+        if isinstance(reply, float):
+            return repr(reply)
+        if isinstance(reply, list):
+            flat = []
+            for item in reply:
+                flat.extend(item if isinstance(item, tuple) else [item])
+            return lua.table(*[repr(item) if isinstance(item, float) else item
+                               for item in flat])
+        return reply
+
+    def register_script(self, source):
+        lupa = pytest.importorskip('lupa')
+
+        def run(keys=(), args=()):
+            lua = lupa.LuaRuntime()
+            lua_globals = lua.globals()
+            lua_globals.KEYS = lua.table(*keys)
+            lua_globals.ARGV = lua.table(*args)
+            lua_globals.redis = lua.table_from({
+                'call': lambda command, *call_args: self._call(lua, command,
+                                                               *call_args)})
+            return lua.execute(source)
+        return run
+
+
+class TestLuaSimilarity:
+
+    def setup_method(self, method):
+        self.backend = RedisBackend(
+            client=LupaScriptClient(fakeredis.FakeStrictRedis()))
+        self.backend.clear()
+        for movie_id, ratings in enumerate([(3, 4), (5, 2), (2, 2), (4, 5)]):
+            self.backend.add_rating(10, movie_id, ratings[0])
+            self.backend.add_rating(11, movie_id, ratings[1])
+        self.backend.add_rating(12, 0, 1)
+
+    def test_reviewer_similarity(self):
+        for sim_function in (sim_pearson, sim_distance):
+            for other in (11, 12, 13):
+                expected = sim_function(
+                    self.backend.get_common_ratings_for_reviewers(10, other))
+                score = self.backend.get_similarity_for_reviewers(
+                    10, other, sim_function)
+                assert abs(score - expected) < 1e-9
+
+    def test_movie_similarity(self):
+        for sim_function in (sim_pearson, sim_distance):
+            expected = sim_function(
+                self.backend.get_common_ratings_for_movies(0, 3))
+            score = self.backend.get_similarity_for_movies(0, 3, sim_function)
+            assert abs(score - expected) < 1e-9
+
+
+class TestPairStats:
+
+    def setup_method(self, method):
+        self.client = RoundTripCounter(fakeredis.FakeStrictRedis())
+        self.backend = RedisBackend(client=self.client, lua_similarity=False,
+                                    pair_stats=('movies', 'reviewers'))
+        self.backend.clear()
+        random.seed(0)
+        for reviewer_id in range(1, 7):
+            for movie_id in random.sample(range(1, 9), 5):
+                self.backend.add_rating(reviewer_id, movie_id,
+                                        random.randint(1, 5))
+        # change some ratings
+        self.backend.add_rating(1, 2, 5)
+        self.backend.add_rating(2, 3, 1)
+        self.backend.add_rating(3, 3, 1)
+
+    def test_movie_similarity(self):
+        for sim_function in (sim_pearson, sim_distance):
+            for movie_1, movie_2 in ((1, 2), (3, 2), (4, 8)):
+                expected = sim_function(
+                    self.backend.get_common_ratings_for_movies(movie_1, movie_2))
+                self.client.round_trips = 0
+                score = self.backend.get_similarity_for_movies(
+                    movie_1, movie_2, sim_function)
+                assert self.client.round_trips == 1
+                assert abs(score - expected) < 1e-9
+
+    def test_reviewer_similarity(self):
+        for sim_function in (sim_pearson, sim_distance):
+            for reviewer_1, reviewer_2 in ((1, 2), (3, 2), (5, 6), (1, 7)):
+                expected = sim_function(self.backend.get_common_ratings_for_reviewers(
+                    reviewer_1, reviewer_2))
+                score = self.backend.get_similarity_for_reviewers(
+                    reviewer_1, reviewer_2, sim_function)
+                assert abs(score - expected) < 1e-9
+
+
+class TestRedisBackendClone:
+
+    def test_clone_keeps_connection_settings(self):
+        client = redis.StrictRedis(unix_socket_path='/tmp/redis.sock',
+                                   password='secret', db=3)
+        backend = RedisBackend(client=client, lua_similarity=False,
+                               pair_stats=('movies',), invalidate_cache=True)
+        clone = backend.clone()
+        pool = clone.redis.connection_pool
+        assert pool is not client.connection_pool
+        assert pool.connection_class is redis.UnixDomainSocketConnection
+        assert pool.connection_kwargs['path'] == '/tmp/redis.sock'
+        assert pool.connection_kwargs['password'] == 'secret'
+        assert pool.connection_kwargs['db'] == 3
+        assert not clone.lua_similarity
+        assert clone.pair_stats == frozenset(['movies'])
+        assert clone.invalidate_cache
+
+    def test_pickle(self):
+        client = redis.StrictRedis(unix_socket_path='/tmp/redis.sock',
+                                   password='secret', db=3)
+        backend = RedisBackend(client=client, lua_similarity=False)
+        backend.add_rating_listener(lambda *args: None)
+        copy = pickle.loads(pickle.dumps(backend))
+        pool = copy.redis.connection_pool
+        assert pool.connection_class is redis.UnixDomainSocketConnection
+        assert pool.connection_kwargs['password'] == 'secret'
+        assert not copy.lua_similarity
+        assert copy._rating_listeners == []
+
+
+class TestMemoryBackend(TestRedisBackend):
+    """
+    Runs the RedisBackend tests against the in-memory backend.
+    """
+
+    @classmethod
+    def setup_class(cls):
+        cls.backend = MemoryBackend()
+
+    def test_overwrite_rating(self):
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating(11, 1, 4)
+        assert self.backend.get_reviewer_rating_for_movie(10, 1) == 3
+        self.backend.add_rating(10, 1, 5)
+        assert self.backend.get_reviewer_rating_for_movie(10, 1) == 5
+        assert self.backend.get_reviewer_rating_for_movie(11, 1) == 4
+        assert self.backend.get_reviewers_for_movie(1) == set([10, 11])
+
+    def test_pickle(self):
+        self.backend.add_rating(10, 1, 3)
+        self.backend.add_rating_listener(lambda *args: None)
+        try:
+            copy = pickle.loads(pickle.dumps(self.backend))
+        finally:
+            del self.backend._rating_listeners[:]
+        assert copy.get_ratings_for_reviewer(10) == {1: 3}
+        assert copy._rating_listeners == []
+
+    def test_from_backend(self):
+        redis_backend = RedisBackend(client=fakeredis.FakeStrictRedis())
+        redis_backend.clear()
+        redis_backend.add_movie(1, "Cujo")
+        redis_backend.add_movie(2, "The Shining")
+        redis_backend.add_rating(10, 1, 3)
+        redis_backend.add_rating(10, 2, 5)
+        redis_backend.add_rating(11, 2, 2)
+        backend = MemoryBackend.from_backend(redis_backend)
+        assert backend.get_movies() == set([1, 2])
+        assert backend.get_names_for_movies([1, 3]) == {
+            1: redis_backend.get_name_for_movie(1), 3: None}
+        assert backend.get_reviewers() == set([10, 11])
+        assert backend.get_unrated_movies_for(11) == set([1])
+        assert backend.get_common_ratings_for_movies(1, 2) == [(3, 5)]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import numpy as np
+
+import recommendr
+from recommendr.db import MemoryBackend
+from recommendr.factorization import FactorModel, OnlineUpdater
+
+
+def low_rank_backend(num_reviewers=40, num_movies=30, density=0.5, seed=0):
+    """
+    A backend whose ratings come from a rank 2 model, clipped to 1-5 stars.
+    """
+    state = np.random.RandomState(seed)
+    reviewers = state.normal(size=(num_reviewers, 2))
+    movies = state.normal(size=(num_movies, 2))
+    ratings = np.clip(np.round(3 + reviewers.dot(movies.T)), 1, 5)
+    backend = MemoryBackend()
+    for movie_id in range(1, num_movies + 1):
+        backend.add_movie(movie_id, "Movie {0}".format(movie_id))
+    for reviewer in range(num_reviewers):
+        for movie in range(num_movies):
+            if state.rand() < density:
+                backend.add_rating(reviewer + 1, movie + 1, ratings[reviewer, movie])
+    return backend
+
+
+class TestFactorModel:
+
+    def setup_method(self, method):
+        self.backend = low_rank_backend()
+        self.model = FactorModel.train(self.backend, num_factors=4,
+                                       regularization=0.01, iterations=15)
+
+    def test_training_error(self):
+        error = self.model.error(*self.backend.get_ratings_matrix())
+        assert error < 0.5
+        untrained = FactorModel(num_factors=4, iterations=0).fit(
+            *self.backend.get_ratings_matrix())
+        assert error < untrained.error(*self.backend.get_ratings_matrix())
+
+    def test_recommend(self):
+        rankings = self.model.recommend(1, num=5)
+        assert len(rankings) == 5
+        assert rankings == sorted(rankings, reverse=True)
+        assert abs(rankings[0][0] - self.model.predict(1, rankings[0][1])) < 1e-9
+        assert self.model.recommend(1, num=5, candidates=set([3, 4])) == \
+            sorted([(self.model.predict(1, 3), 3), (self.model.predict(1, 4), 4)],
+                   reverse=True)
+        assert self.model.recommend(1000) == []
+
+    def test_fold_in(self):
+        matrix, reviewer_ids, _ = self.backend.get_ratings_matrix()
+        solved = self.model._solve(matrix.tocsr(), self.model.movie_factors)
+        ratings = self.backend.get_ratings_for_reviewer(1)
+        assert not self.model.knows_reviewer(1000)
+        vector = self.model.fold_in(1000, ratings)
+        assert self.model.knows_reviewer(1000)
+        # the same solve an ALS sweep makes for a reviewer rating like 1
+        assert np.allclose(vector, solved[list(reviewer_ids).index(1)])
+        assert np.allclose(self.model.predict(1000, 2),
+                           self.model.mean + vector.dot(self.model.movie_factors[1]))
+        assert self.model.recommend(1000, num=5)
+
+    def test_partial_fit(self):
+        before = abs(5 - self.model.predict(1, 1))
+        self.model.partial_fit(1, 1, 5, learning_rate=0.05, steps=5)
+        assert abs(5 - self.model.predict(1, 1)) < before
+        self.model.partial_fit(1000, 1000, 4)
+        assert self.model.knows_reviewer(1000)
+        assert 1000 in self.model.movie_ids
+        assert np.isfinite(self.model.predict(1000, 1000))
+
+    def test_online_updater(self):
+        path = os.path.join(tempfile.mkdtemp(), 'model.npz')
+        updater = OnlineUpdater(self.model, path=path, snapshot_every=2)
+        self.backend.add_rating_listener(updater)
+        self.backend.add_rating(1000, 1, 5)
+        assert updater.updates == 1
+        assert not os.path.exists(path)
+        updater.consume([(1000, 2, 4)])
+        assert os.path.exists(path)
+        assert FactorModel.load(path).knows_reviewer(1000)
+
+    def test_save_and_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'model.npz')
+        self.model.save(path)
+        model = FactorModel.load(path)
+        assert model.num_factors == 4
+        assert model.recommend(1, num=5) == self.model.recommend(1, num=5)
+
+    def test_get_model_based_recommendations(self):
+        original_db = recommendr.db
+        recommendr.db = self.backend
+        try:
+            rankings = recommendr.get_model_based_recommendations(1, self.model, num=50)
+        finally:
+            recommendr.db = original_db
+        rated = self.backend.get_ratings_for_reviewer(1)
+        assert len(rankings) == 30 - len(rated)
+        assert not set(movie_id for _, movie_id in rankings) & set(rated)
+
+    def test_get_model_based_recommendations_new_reviewer(self):
+        for movie_id in (1, 2, 3, 4, 5):
+            self.backend.add_rating(1000, movie_id, 5)
+        original_db = recommendr.db
+        recommendr.db = self.backend
+        try:
+            rankings = recommendr.get_model_based_recommendations(1000, self.model)
+        finally:
+            recommendr.db = original_db
+        assert len(rankings) == 20
+        assert not set(movie_id for _, movie_id in rankings) & set([1, 2, 3, 4, 5])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+
+import fakeredis
+import pytest
+
+import recommendr
+from recommendr.db import RedisBackend, MemoryBackend
+from recommendr.lsh import ReviewerLSHIndex
+from recommendr.similarity import sim_distance
+
+
+class TestReviewerLSHIndex:
+
+    def make_backend(self):
+        return MemoryBackend()
+
+    def setup_method(self, method):
+        self.backend = self.make_backend()
+        random.seed(0)
+        for reviewer_id in range(1, 41):
+            for movie_id in random.sample(range(1, 31), 12):
+                self.backend.add_rating(reviewer_id, movie_id, random.randint(1, 5))
+        # reviewer 100 rates exactly as reviewer 1 does, shifted by one star
+        for movie_id, rating in self.backend.get_ratings_for_reviewer(1).items():
+            self.backend.add_rating(100, movie_id, rating + 1)
+        self.index = ReviewerLSHIndex(self.backend, num_tables=4, num_bits=6)
+        self.index.build()
+
+    def test_candidates(self):
+        candidates = self.index.candidates(1)
+        assert 1 in candidates
+        assert 100 in candidates
+        assert candidates <= self.backend.get_reviewers()
+
+    def test_more_bits_fewer_candidates(self):
+        coarse = ReviewerLSHIndex(self.backend, num_tables=4, num_bits=1)
+        coarse.build()
+        total = sum(len(self.index.candidates(reviewer_id)) for reviewer_id in range(1, 41))
+        coarse_total = sum(len(coarse.candidates(reviewer_id)) for reviewer_id in range(1, 41))
+        assert total < coarse_total
+
+    def test_update(self):
+        for movie_id, rating in self.backend.get_ratings_for_reviewer(2).items():
+            self.backend.add_rating(200, movie_id, rating)
+        assert 200 not in self.index.candidates(2)
+        self.index.update([200])
+        assert 200 in self.index.candidates(2)
+
+    def test_watch(self):
+        self.index.watch()
+        for movie_id, rating in self.backend.get_ratings_for_reviewer(2).items():
+            self.backend.add_rating(200, movie_id, rating)
+        assert 200 in self.index.candidates(2)
+
+    def test_closest_reviewers(self):
+        original_db = recommendr.db
+        recommendr.db = self.backend
+        try:
+            scores = recommendr.closest_reviewers(1, n=3, lsh_index=self.index)
+        finally:
+            recommendr.db = original_db
+        assert scores[0][1] == 100
+        assert abs(scores[0][0] - 1) < 1e-9
+
+    def test_closest_reviewers_warns_for_other_similarities(self):
+        original_db = recommendr.db
+        recommendr.db = self.backend
+        try:
+            with pytest.warns(UserWarning):
+                recommendr.closest_reviewers(1, n=3, similarity=sim_distance,
+                                             lsh_index=self.index)
+        finally:
+            recommendr.db = original_db
+
+
+class TestRedisReviewerLSHIndex(TestReviewerLSHIndex):
+    """
+    Runs the index tests with buckets stored in Redis.
+    """
+
+    def make_backend(self):
+        backend = RedisBackend(client=fakeredis.FakeStrictRedis(),
+                               lua_similarity=False)
+        backend.clear()
+        return backend
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import recommendr
+from recommendr.factorization import FactorModel
+from recommendr.mips import FactorIndex
+
+from .test_factorization import low_rank_backend
+
+
+class TestFactorIndex:
+
+    def setup_method(self, method):
+        self.backend = low_rank_backend(num_movies=60)
+        self.model = FactorModel.train(self.backend, num_factors=4,
+                                       regularization=0.01, iterations=15)
+        self.index = FactorIndex(self.model, num_clusters=6, probes=2).build()
+
+    def test_build(self):
+        assert sorted(self.index.movie_ids) == sorted(self.model.movie_ids)
+        assert self.index.offsets[-1] == 60
+        assert len(self.index.offsets) == 7
+
+    def test_all_probes_is_exact(self):
+        for reviewer_id in (1, 2, 3):
+            assert self.index.recommend(reviewer_id, num=10, probes=6) == \
+                self.model.recommend(reviewer_id, num=10)
+
+    def test_recall(self):
+        found = 0
+        for reviewer_id in range(1, 41):
+            exact = self.model.recommend(reviewer_id, num=5)
+            approximate = self.index.recommend(reviewer_id, num=5)
+            found += len(set(exact) & set(approximate))
+        assert found / 200.0 > 0.6
+
+    def test_recommend_candidates(self):
+        candidates = set(range(1, 61, 3))
+        rankings = self.index.recommend(1, num=5, candidates=candidates, probes=6)
+        assert rankings == self.model.recommend(1, num=5, candidates=candidates)
+        assert self.index.recommend(1000) == []
+
+    def test_get_model_based_recommendations(self):
+        original_db = recommendr.db
+        recommendr.db = self.backend
+        try:
+            rankings = recommendr.get_model_based_recommendations(
+                1, self.model, num=10, index=self.index)
+        finally:
+            recommendr.db = original_db
+        assert len(rankings) == 10
+        assert not set(movie_id for _, movie_id in rankings) & \
+            set(self.backend.get_ratings_for_reviewer(1))
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+import time
+
+import fakeredis
+import pytest
+
+import recommendr
+from recommendr.db import MemoryBackend, RedisBackend
+from recommendr.similarity import sim_pearson, sim_distance
+
+
+def reference_user_based_recommendations(reviewer_id, similarity):
+    """
+    The original movie-by-movie algorithm, scoring every rating separately.
+    """
+    db = recommendr.db
+    totals = {}
+    sim_sums = {}
+    for movie_id in db.get_unrated_movies_for(reviewer_id):
+        for reviewer in db.get_reviewers_for_movie(movie_id):
+            sim = recommendr.get_reviewer_similarity(reviewer_id, reviewer,
+                                                     sim_function=similarity)
+            if sim <= 0:
+                continue
+            rating = db.get_reviewer_rating_for_movie(reviewer, movie_id)
+            totals[movie_id] = totals.get(movie_id, 0) + rating * sim
+            sim_sums[movie_id] = sim_sums.get(movie_id, 0) + sim
+    return sorted([(total / sim_sums[movie_id], movie_id)
+                   for movie_id, total in totals.items()], reverse=True)
+
+
+class TestRecommendr:
+    """
+    Runs the recommendation functions against an in-memory database of
+    random ratings.
+    """
+
+    def setup_method(self, method):
+        self.original_db = recommendr.db
+        backend = MemoryBackend()
+        random.seed(0)
+        for movie_id in range(1, 31):
+            backend.add_movie(movie_id, "Movie {0}".format(movie_id))
+        for reviewer_id in range(1, 21):
+            for movie_id in random.sample(range(1, 31), 12):
+                backend.add_rating(reviewer_id, movie_id, random.randint(1, 5))
+        recommendr.db = self.backend = backend
+
+    def teardown_method(self, method):
+        recommendr.db = self.original_db
+
+    def assert_same_scores(self, scores, expected):
+        assert len(scores) == len(expected)
+        for (score, _), (expected_score, _) in zip(scores, expected):
+            assert abs(score - expected_score) < 1e-9
+
+    def test_closest_reviewers(self):
+        scores = [(recommendr.get_reviewer_similarity(3, other), other)
+                  for other in range(1, 21) if other != 3]
+        scores.sort()
+        scores.reverse()
+        assert recommendr.closest_reviewers(3, n=5, min_common=0) == scores[:5]
+
+    def test_closest_reviewers_min_common(self):
+        self.backend.add_rating(99, 100, 5)
+        counts = recommendr.co_reviewer_counts(3)
+        assert 3 not in counts
+        assert 99 not in counts
+        assert counts[5] == len(self.backend.get_common_ratings_for_reviewers(3, 5))
+        scores = recommendr.closest_reviewers(3, n=20)
+        assert set(reviewer for _, reviewer in scores) == set(counts)
+        scores = recommendr.closest_reviewers(3, n=20, min_common=6)
+        expected = set(other for other, count in counts.items() if count >= 6)
+        assert set(reviewer for _, reviewer in scores) == expected
+
+    def test_closest_reviewers_candidates(self):
+        candidates = (other for other in range(1, 21) if other % 2)
+        scores = recommendr.closest_reviewers(3, n=20, candidates=candidates)
+        assert len(scores) == 9
+        assert set(reviewer for _, reviewer in scores) == set(range(1, 21, 2)) - set([3])
+
+    def test_closest_movies_candidates(self):
+        scores = recommendr.closest_movies(7, n=2, candidates=[1, 2, 3, 7])
+        expected = sorted([(recommendr.get_movie_similarity(7, other), other)
+                           for other in (1, 2, 3)], reverse=True)
+        assert scores == expected[:2]
+
+    def test_closest_reviewers_batch(self):
+        for similarity in (sim_pearson, sim_distance):
+            expected = recommendr.closest_reviewers(3, n=5, similarity=similarity)
+            scores = recommendr.closest_reviewers(3, n=5, similarity=similarity,
+                                                  batch=True)
+            self.assert_same_scores(scores, expected)
+            assert 3 not in [reviewer for _, reviewer in scores]
+
+    def test_batch_matrix(self):
+        matrix = self.backend.get_ratings_matrix()
+        expected = recommendr.closest_reviewers(3, n=5, batch=True)
+        recommendr.db = RedisBackend(client=fakeredis.FakeStrictRedis())
+        with pytest.raises(ValueError):
+            recommendr.closest_reviewers(3, n=5, batch=True)
+        with pytest.raises(ValueError):
+            recommendr.closest_movies(7, n=5, batch=True)
+        assert recommendr.closest_reviewers(3, n=5, batch=True,
+                                            matrix=matrix) == expected
+        recommendr.db = self.backend
+        assert recommendr.closest_movies(7, n=5, batch=True, matrix=matrix) == \
+            recommendr.closest_movies(7, n=5, batch=True)
+
+    def test_closest_reviewers_batch_min_common(self):
+        # reviewer 99 shares no movies with 3, so would score 1.0 by distance
+        self.backend.add_rating(99, 100, 5)
+        for batch in (False, True):
+            scores = recommendr.closest_reviewers(3, n=30, similarity=sim_distance,
+                                                  batch=batch)
+            assert 99 not in [reviewer for _, reviewer in scores]
+        scores = recommendr.closest_reviewers(3, n=30, similarity=sim_distance,
+                                              batch=True, min_common=0)
+        assert (1.0, 99) in scores
+        expected = recommendr.get_user_based_recommendations(3, neighbors=3)
+        rankings = recommendr.get_user_based_recommendations(3, neighbors=3,
+                                                             batch=True)
+        self.assert_same_scores(rankings, expected)
+
+    def test_batch_unsupported_similarity(self):
+        def sim_constant(pairs):
+            return 0.5
+
+        assert len(recommendr.closest_reviewers(3, n=3, similarity=sim_constant)) == 3
+        for call in (
+                lambda: recommendr.closest_reviewers(3, similarity=sim_constant,
+                                                     batch=True),
+                lambda: recommendr.closest_movies(7, similarity=sim_constant,
+                                                  batch=True),
+                lambda: list(recommendr.recommend_many([3], similarity=sim_constant))):
+            with pytest.raises(ValueError) as error:
+                call()
+            assert 'sim_constant' in str(error.value)
+            assert 'sim_pearson' in str(error.value)
+
+    def test_closest_movies_batch(self):
+        expected = recommendr.closest_movies(7, n=5)
+        scores = recommendr.closest_movies(7, n=5, batch=True)
+        self.assert_same_scores(scores, expected)
+
+    def test_calculate_similar_movies_in_matrix(self):
+        for similarity in (sim_pearson, sim_distance):
+            self.backend._similarities = {}
+            recommendr.calculate_similar_movies_in_matrix(
+                n=5, similarity=similarity, block_size=7)
+            saved = self.backend.get_similarity_scores(range(1, 31))
+            for movie_id in range(1, 31):
+                expected = recommendr.closest_movies(movie_id, n=5,
+                                                     similarity=similarity)
+                self.assert_same_scores(saved[movie_id], expected)
+
+    def test_calculate_similar_movies_in_matrix_unlisted_movie(self):
+        # movie 100 is rated, but was never added
+        self.backend.add_rating(1, 100, 5)
+        self.backend.add_rating(2, 100, 4)
+        recommendr.calculate_similar_movies_in_matrix(n=30)
+        saved = self.backend.get_similarity_scores(range(1, 31))
+        for scores in saved.values():
+            assert 100 not in [movie_id for _, movie_id in scores]
+        assert not self.backend.get_similarity_scores([100]).get(100)
+        scores = recommendr.closest_movies(1, n=30, batch=True)
+        assert 100 not in [movie_id for _, movie_id in scores]
+
+    def test_calculate_similar_movies(self):
+        calls = []
+        get_similarity_for_movies = self.backend.get_similarity_for_movies
+
+        def counted(*args, **kwargs):
+            calls.append(args)
+            return get_similarity_for_movies(*args, **kwargs)
+        self.backend.get_similarity_for_movies = counted
+
+        recommendr.calculate_similar_movies(n=5)
+        # each unordered pair is scored once
+        assert len(calls) == 30 * 29 // 2
+        saved = self.backend.get_similarity_scores(range(1, 31))
+        for movie_id in range(1, 31):
+            assert saved[movie_id] == recommendr.closest_movies(movie_id, n=5)
+
+    def test_refresh_similar_movies(self):
+        recommendr.calculate_similar_movies(n=5)
+        assert recommendr.refresh_similar_movies(n=5) == set()
+        self.backend.add_rating(3, 7, 5)
+        self.backend.add_rating(4, 7, 1)
+        refreshed = recommendr.refresh_similar_movies(n=5)
+        assert 7 in refreshed
+        assert self.backend.get_movies_similar_to(7) <= refreshed
+        saved = self.backend.get_similarity_scores(range(1, 31))
+        for movie_id in refreshed:
+            assert saved[movie_id] == recommendr.closest_movies(movie_id, n=5)
+
+    def test_refresh_similar_movies_failure(self):
+        recommendr.calculate_similar_movies(n=5)
+        self.backend.add_rating(3, 7, 5)
+        self.backend.add_rating(3, 8, 5)
+        save_similarity_scores = self.backend.save_similarity_scores
+        saved = []
+
+        def failing(movie_id, scores):
+            if saved:
+                raise IOError("connection lost")
+            saved.append(movie_id)
+            save_similarity_scores(movie_id, scores)
+        self.backend.save_similarity_scores = failing
+        with pytest.raises(IOError):
+            recommendr.refresh_similar_movies(n=5)
+        dirty = self.backend.take_dirty_movies()
+        assert saved[0] not in dirty
+        assert len(dirty) > 1
+        self.backend.mark_dirty_movies(dirty)
+        del self.backend.save_similarity_scores
+        refreshed = recommendr.refresh_similar_movies(n=5)
+        assert refreshed >= dirty
+
+    def test_similarity_refresher(self):
+        self.backend.add_rating(3, 7, 5)
+        refresher = recommendr.SimilarityRefresher(interval=60, n=5)
+        refresher.start()
+        refresher.stop()
+        refresher.join(5)
+        assert not refresher.is_alive()
+        assert self.backend.take_dirty_movies() == set()
+
+    def test_calculate_similar_movies_min_overlap(self):
+        calls = []
+        get_similarity_for_movies = self.backend.get_similarity_for_movies
+
+        def counted(*args, **kwargs):
+            calls.append(args)
+            return get_similarity_for_movies(*args, **kwargs)
+        self.backend.get_similarity_for_movies = counted
+
+        recommendr.calculate_similar_movies(n=5, min_overlap=5, num_hashes=128)
+        assert 0 < len(calls) < 30 * 29 // 2
+        for movie_1, movie_2 in calls:
+            # pairs scored are mostly those with enough reviewers in common
+            assert len(self.backend.get_common_ratings_for_movies(movie_1, movie_2)) >= 2
+
+    def test_calculate_similar_movies_in_processes(self):
+        recommendr.calculate_similar_movies(n=5, executor='process', processes=2)
+        saved = self.backend.get_similarity_scores(range(1, 31))
+        for movie_id in range(1, 31):
+            assert saved[movie_id] == recommendr.closest_movies(movie_id, n=5)
+
+    def test_calculate_similar_movies_in_spawned_processes(self):
+        recommendr.calculate_similar_movies(n=5, executor='process', processes=2,
+                                            start_method='spawn')
+        saved = self.backend.get_similarity_scores(range(1, 31))
+        for movie_id in range(1, 31):
+            assert saved[movie_id] == recommendr.closest_movies(movie_id, n=5)
+
+    def test_get_item_based_recommendations(self):
+        self.backend.clear()
+        self.backend.add_rating(1, 1, 5)
+        self.backend.add_rating(1, 2, 1)
+        self.backend.save_similarity_scores(1, [(0.5, 3), (0.25, 4), (-1, 5)])
+        self.backend.save_similarity_scores(2, [(0.5, 3), (0.9, 1)])
+        rankings = recommendr.get_item_based_recommendations(1)
+        assert rankings == [(5, 4), (3, 3)]
+        assert recommendr.get_item_based_recommendations(1, num=1) == [(5, 4)]
+
+    def test_get_user_based_recommendations(self):
+        for similarity in (sim_pearson, sim_distance):
+            expected = reference_user_based_recommendations(3, similarity)
+            rankings = recommendr.get_user_based_recommendations(
+                3, num=len(expected), similarity=similarity)
+            self.assert_same_scores(rankings, expected)
+            rankings = recommendr.get_user_based_recommendations(
+                3, num=4, similarity=similarity)
+            self.assert_same_scores(rankings, expected[:4])
+
+    def test_get_user_based_recommendations_budget(self):
+        expected = recommendr.get_user_based_recommendations(3, num=10)
+        assert expected.complete
+        rankings = recommendr.get_user_based_recommendations(3, num=10, budget=60)
+        assert rankings.complete
+        self.assert_same_scores(rankings, expected)
+        rankings = recommendr.get_user_based_recommendations(3, num=10, budget=0)
+        assert not rankings.complete
+        assert rankings == []
+
+    def test_get_user_based_recommendations_budget_no_contributors(self):
+        calls = []
+
+        def slow_anticorrelated(pairs):
+            calls.append(pairs)
+            time.sleep(0.01)
+            return -1
+
+        rankings = recommendr.get_user_based_recommendations(
+            3, num=10, similarity=slow_anticorrelated, budget=0.02)
+        assert not rankings.complete
+        assert rankings == []
+        assert len(calls) < 19
+
+    def test_scored_neighbors_prioritize(self):
+        counts = recommendr.co_reviewer_counts(3)
+        ratings = self.backend.get_ratings_for_reviewer(3)
+        others = [other for _, other, _ in recommendr._scored_neighbors(
+            3, ratings, sim_pearson, prioritize=True)]
+        assert sorted(others) == sorted(set(range(1, 21)) - set([3]))
+        assert [counts[other] for other in others] == \
+            sorted([counts[other] for other in others], reverse=True)
+
+    def test_iter_user_based_scores(self):
+        scores = {}
+        updates = 0
+        for score, movie_id in recommendr.iter_user_based_scores(
+                3, similarity=sim_pearson):
+            scores[movie_id] = score
+            updates += 1
+        assert updates > len(scores)
+        expected = reference_user_based_recommendations(3, sim_pearson)
+        self.assert_same_scores(sorted([(score, movie_id) for movie_id, score
+                                        in scores.items()], reverse=True),
+                                expected)
+
+    def test_recommend_many(self):
+        self.backend.add_rating(21, 100, 4)  # rates an unlisted movie
+        reviewers = [3, 21, 99, 7, 12]
+        for similarity in (sim_pearson, sim_distance):
+            results = list(recommendr.recommend_many(
+                reviewers, num=10, similarity=similarity, block_size=2))
+            assert [reviewer_id for reviewer_id, _ in results] == reviewers
+            for reviewer_id, rankings in results:
+                expected = recommendr.get_user_based_recommendations(
+                    reviewer_id, num=10, similarity=similarity)
+                self.assert_same_scores(rankings, expected)
+
+    def test_get_user_based_recommendations_neighbors(self):
+        closest = recommendr.closest_reviewers(3, n=3, similarity=sim_pearson)
+        unrated = self.backend.get_unrated_movies_for(3)
+        totals, sim_sums = {}, {}
+        for sim, other in closest:
+            for movie_id, rating in self.backend.get_ratings_for_reviewer(other).items():
+                if sim > 0 and movie_id in unrated:
+                    totals[movie_id] = totals.get(movie_id, 0) + rating * sim
+                    sim_sums[movie_id] = sim_sums.get(movie_id, 0) + sim
+        expected = sorted([(total / sim_sums[movie_id], movie_id)
+                           for movie_id, total in totals.items()], reverse=True)
+        for batch in (False, True):
+            rankings = recommendr.get_user_based_recommendations(
+                3, num=30, similarity=sim_pearson, neighbors=3, batch=batch)
+            self.assert_same_scores(rankings, expected)
+
+    def test_get_user_based_recommendations_batch_redis(self):
+        expected = recommendr.get_user_based_recommendations(
+            3, num=30, similarity=sim_pearson, neighbors=3, batch=True)
+        redis_backend = RedisBackend(client=fakeredis.FakeStrictRedis(),
+                                     lua_similarity=False)
+        redis_backend.clear()
+        for movie_id in self.backend.get_movies():
+            redis_backend.add_movie(movie_id, "Movie {0}".format(movie_id))
+        ratings = self.backend.get_ratings_for_reviewers(self.backend.get_reviewers())
+        for reviewer_id, reviews in ratings.items():
+            for movie_id, rating in reviews.items():
+                redis_backend.add_rating(reviewer_id, movie_id, rating)
+        recommendr.db = redis_backend
+        with pytest.raises(ValueError):
+            recommendr.get_user_based_recommendations(
+                3, num=30, similarity=sim_pearson, neighbors=3, batch=True)
+        rankings = recommendr.get_user_based_recommendations(
+            3, num=30, similarity=sim_pearson, neighbors=3, batch=True,
+            matrix=redis_backend.get_ratings_matrix())
+        self.assert_same_scores(rankings, expected)
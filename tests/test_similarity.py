@@ -1,2 +1,68 @@
+import random
+
+import numpy as np
+from scipy import sparse
+
+from recommendr.similarity import (sim_distance, sim_pearson, sim_cosine,
+                                   sim_distance_array, sim_pearson_array,
+                                   sim_cosine_array, pairwise_rating_sums,
+                                   rating_sums)
+
+
 def test_hookup():
     assert 1 + 1 == 2
+
+
+def random_ratings(num_movies, num_rated):
+    ratings = np.zeros(num_movies)
+    for movie in random.sample(range(num_movies), num_rated):
+        ratings[movie] = random.randint(1, 5)
+    return ratings
+
+
+def common_ratings(ratings_1, ratings_2):
+    return [(rating_1, rating_2) for rating_1, rating_2 in zip(ratings_1, ratings_2)
+            if rating_1 and rating_2]
+
+
+class TestArraySimilarity:
+
+    def setup_method(self, method):
+        random.seed(0)
+        self.ratings = random_ratings(40, 20)
+        self.others = np.array([random_ratings(40, 15) for _ in range(10)])
+        # no ratings in common, and no variance
+        self.others[0] = np.where(self.ratings == 0, 3, 0)
+        self.others[1] = np.where(self.ratings != 0, 4, 0)
+
+    def test_aligned_vectors(self):
+        ratings = [(3, 4), (5, 2), (1, 1), (4, 5)]
+        ratings_1, ratings_2 = zip(*ratings)
+        assert np.allclose(sim_pearson_array(ratings_1, ratings_2),
+                           sim_pearson(ratings))
+        assert np.allclose(sim_distance_array(ratings_1, ratings_2),
+                           sim_distance(ratings))
+
+    def test_vector_against_matrix(self):
+        for sim_function, array_function in ((sim_pearson, sim_pearson_array),
+                                             (sim_distance, sim_distance_array),
+                                             (sim_cosine, sim_cosine_array)):
+            expected = [sim_function(common_ratings(self.ratings, other))
+                        for other in self.others]
+            scores = array_function(self.ratings, self.others)
+            assert scores.shape == (len(self.others),)
+            assert np.allclose(scores, expected)
+
+    def test_vector_against_sparse_matrix(self):
+        others = sparse.csr_matrix(self.others)
+        for array_function in (sim_pearson_array, sim_distance_array):
+            assert np.allclose(array_function(self.ratings, others),
+                               array_function(self.ratings, self.others))
+
+    def test_pairwise_rating_sums(self):
+        matrix = sparse.csc_matrix(self.others.T)
+        sums = pairwise_rating_sums(matrix, [2, 5])
+        for offset, column in enumerate([2, 5]):
+            expected = rating_sums(self.others[column], self.others)
+            for pairwise, single in zip(sums, expected):
+                assert np.allclose(pairwise[:, offset], single)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from recommendr.sketch import MinHashSketches
+
+
+class TestMinHashSketches:
+
+    def setup_method(self, method):
+        self.sketches = MinHashSketches(num_hashes=256)
+        self.sketches.add(1, range(0, 100))
+        self.sketches.add(2, range(0, 100))
+        self.sketches.add(3, range(50, 150))
+        self.sketches.add(4, range(1000, 1100))
+        self.sketches.add(5, [])
+
+    def test_estimate_overlaps(self):
+        identical, half, disjoint, empty = self.sketches.estimate_overlaps(
+            1, [2, 3, 4, 5])
+        assert identical == 100
+        assert 35 < half < 65
+        assert disjoint < 5
+        assert empty == 0
+
+    def test_candidates(self):
+        assert self.sketches.candidates(1, [2, 3, 4, 5], 20) == [2, 3]
+        assert self.sketches.candidates(1, [], 20) == []
+
+    def test_replace(self):
+        self.sketches.add(4, range(0, 100))
+        assert self.sketches.estimate_overlaps(1, [4])[0] == 100